@@ -33,8 +33,8 @@ from jobid import resolve_jobid_filename, put_workspaces
 from extras import DotDict, Temp
 
 from threading import Thread
-from os import unlink
-from os.path import join
+from os import unlink, listdir
+from os.path import join, exists
 
 METHODS_CONFIGFILENAME = 'methods.conf'
 #DIRECTORIES      = ['analysis', 'default_analysis', ]
@@ -78,6 +78,13 @@ class Main:
 		# set current workspace pointers
 		self.set_workspace(self.config['main_workspace'])
 		self.set_remote_workspaces(self.config.get('remote_workspaces', ''))
+		# Jobs that were still waiting for deferred compression when the
+		# daemon last stopped.
+		W = self.workspaces[self.current_workspace]
+		from jobid import dirnamematcher
+		from dataset import DEFERRED_MARKER
+		jobdirs = [join(W.path, jid) for jid in sorted(filter(dirnamematcher(W.name), listdir(W.path)))]
+		self._compress_deferred([jd for jd in jobdirs if exists(join(jd, DEFERRED_MARKER))])
 		# and update contents
 		self.DataBase = database.DataBase(self)
 		self.update_database()
@@ -231,6 +238,22 @@ class Main:
 		data['files'] = files
 		data['subjobs'] = subjobs
 		json_save(data, resolve_jobid_filename(jobid, 'post.json'))
+		# Columns written with defer_compression are compressed now that
+		# the job is done, without holding up the next job.
+		from dataset import DEFERRED_MARKER
+		if exists(join(W.path, jobid, DEFERRED_MARKER)):
+			self._compress_deferred([join(W.path, jobid)])
+
+	def _compress_deferred(self, jobdirs):
+		"""Run dataset.compress_deferred on jobdirs (one at a time) in the background."""
+		from dataset import compress_deferred
+		def run():
+			for jobdir in jobdirs:
+				compress_deferred(jobdir)
+		if jobdirs:
+			t = Thread(target=run, name='deferred compression')
+			t.daemon = True
+			t.start()
 
 
 	def get_methods(self):
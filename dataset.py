@@ -24,8 +24,8 @@ from __future__ import unicode_literals
 
 import os
 from keyword import kwlist
-from collections import namedtuple
-from itertools import compress
+from collections import namedtuple, OrderedDict
+from itertools import compress, islice
 from functools import partial
 from inspect import getargspec
 
@@ -34,7 +34,7 @@ from compat import unicode, uni, ifilter, imap, izip, iteritems, str_types, buil
 import blob
 from extras import DotDict, job_params
 from jobid import resolve_jobid_filename
-from gzwrite import typed_writer
+from gzwrite import typed_writer, dict_type, sidecar_type, GzWriteBlocked, GzWriteBloom, GzWriteGroup, GzWriteRecompress
 from status import status
 
 kwlist = set(kwlist)
@@ -43,7 +43,7 @@ kwlist.update({'False', 'None', 'True', 'nonlocal', 'async', 'await'})
 iskeyword = frozenset(kwlist).__contains__
 
 # A dataset is defined by a pickled DotDict containing at least the following (all strings are unicode):
-#     version = (2, 2,),
+#     version = (2, 5,),
 #     filename = "filename" or None,
 #     hashlabel = "column name" or None,
 #     caption = "caption",
@@ -53,6 +53,8 @@ iskeyword = frozenset(kwlist).__contains__
 #     lines = [line, count, per, slice,],
 #     cache = ((id, data), ...), # key is missing if there is no cache in this dataset
 #     cache_distance = datasets_since_last_cache, # key is missing if previous is None
+#     deferred = {"column name": "compression",}, # key is missing if no columns are waiting to be compressed
+#     groups = {"column name": "group name",}, # key is missing if there are no grouped columns
 #
 # A DatasetColumn has these fields:
 #     type = "type", # something that exists in type2iter
@@ -62,6 +64,9 @@ iskeyword = frozenset(kwlist).__contains__
 #     min = minimum value in this dataset or None
 #     max = maximum value in this dataset or None
 #     offsets = (offset, per, slice) or None for non-merged slices.
+#     codec = "gzip", "raw", "bz2" or "lzma" (see gzwrite.codecs), None in older datasets (meaning gzip)
+#     index = "jobid/path/with/%s/for/sliceno" or None, where the block index pickles (see below) are.
+#     bloom = "jobid/path/with/%s/for/sliceno" or None, where the per slice Bloom filter pickles are.
 #
 # Going from a DatasetColumn to a filename is like this for version 2 datasets:
 #     jid, path = dc.location.split('/', 1)
@@ -72,7 +77,65 @@ iskeyword = frozenset(kwlist).__contains__
 #         resolve_jobid_filename(jid, path % sliceno)
 # There is a ds.column_filename function to do this for you (not the seeking, obviously).
 #
+# Columns written with defer_compression are written as gzip without
+# compression (level 0) and listed in deferred (their codec is "gzip"
+# either way). After the job is done the daemon recompresses each file in
+# place (see compress_deferred) and removes them from deferred. Readers
+# don't care which they get.
+#
+# Dictionary encoded columns ("ascii:dict", "bytes:dict", "unicode:dict")
+# have int32 codes in the column file and the values for each slice in
+# a pickle next to it (filename + ".dict.pickle"), [None, value, ...] with
+# the value for each code (see gzwrite._mkdictwriter). They are never
+# merged, and only gzip or raw compressed.
+#
+# Delta encoded columns ("int64:delta", "int32:delta", "date:delta",
+# "datetime:delta") have (delta, run length) pairs in a number column
+# instead of one value per row (see gzwrite._mkdeltawriter). Each writer
+# starts from 0, so these work with merging and block_rows, but the
+# readers can't give numpy arrays.
+#
+# Heap string columns ("ascii:heap", "bytes:heap", "unicode:heap") have
+# the encoded values back to back in the column file, and an int64 end
+# offset per value (None for None) in filename + ".offsets", see
+# gzwrite._mkheapwriter. They have the same restrictions as dictionary
+# encoded columns.
+#
+# Flat list and set columns ("list:int64", "set:ascii" and so on) have an
+# int32 length per row (None for None) in the column file and all the
+# values in filename + ".values", see gzwrite._mkflatlistwriter. They
+# have the same restrictions as dictionary encoded columns, and can't
+# be the hashlabel.
+#
+# A column written with block_rows has a new gzip member (or raw block) every
+# block_rows values, and a per slice index {'rows': [...], 'offsets': [...],
+# 'min': [...], 'max': [...]} with the first row and byte offset (relative to
+# the start of the slice) of each block, and the min/max values in the block.
+# Readers can seek to any block start, see ds._column_iterator, and range
+# iteration skips blocks that can't match, see ds._zone_runs.
+#
+# Grouped columns (DatasetWriter(column_groups=...)) share a file per
+# slice with the other columns in the group, so their location and index
+# are for the group, not the column. Each block (block_rows rows) has a
+# gzip member (or raw block) per column, and the index is
+# {'rows': [...], 'offsets': {name: [...]}, 'min': {name: [...]}, 'max': {name: [...]}}
+# where name is dc.name. These files are never merged. Readers have to
+# read the blocks one at a time, see ds._column_iterator.
+#
+# A column written with a Bloom filter has {'k': k, 'bits': bytearray} per
+# slice (see gzwrite.bloom_build), built from the hash the column writer
+# gives the values (so only for types with a writer.hash).
+# Iteration with a some_set.__contains__ filter on that column skips slices
+# that can't have any of the values, see ds._bloom_may_contain.
+#
 # The dataset pickle is jid/name/dataset.pickle, so jid/default/dataset.pickle for the default dataset.
+#
+# Datasets with a previous also have a chain index in jid/name/dataset.chain.pickle:
+#     entries = [(dsid, lines, {colname: (min, max)}), ...], # this dataset, previous, previous.previous, ...
+#     base = dsid or None, # the dataset before the last entry (which has its own index, or not)
+# There are at most _chain_index_span entries, so ds.chain can resolve that
+# many datasets (with lines and min/max, enough to skip datasets in
+# iteration) per file read, see ds._walk_chain.
 
 def _clean_name(n, seen_n):
 	n = ''.join(c if c.isalnum() else '_' for c in n)
@@ -98,18 +161,57 @@ def _dsid(t):
 # If we want to add fields to later versions, using a versioned name will
 # allow still loading the old versions without messing with the constructor.
 _DatasetColumn_2_0 = namedtuple('_DatasetColumn_2_0', 'type name location min max offsets')
-DatasetColumn = _DatasetColumn_2_0
+_DatasetColumn_2_3 = namedtuple('_DatasetColumn_2_3', 'type name location min max offsets codec')
+_DatasetColumn_2_4 = namedtuple('_DatasetColumn_2_4', 'type name location min max offsets codec index')
+_DatasetColumn_2_4.__new__.__defaults__ = (None, None,)
+_DatasetColumn_2_5 = namedtuple('_DatasetColumn_2_5', 'type name location min max offsets codec index bloom')
+_DatasetColumn_2_5.__new__.__defaults__ = (None, None, None,)
+DatasetColumn = _DatasetColumn_2_5
 
 class _New_dataset_marker(unicode): pass
 _new_dataset_marker = _New_dataset_marker('new')
 
-_ds_cache = {}
+_chain_index_span = 256
+
+# The selectors for each byte of a (little endian) bitmap.
+_bit_table = [tuple(bool(b & (1 << i)) for i in range(8)) for b in range(256)]
+
+# {(dataset, hashlabel, sliceno, SLICES): plan}, see Dataset._rehash_plan.
+_rehash_plans = {}
+
+# Least recently used dataset pickles are dropped when there are more than this.
+_ds_cache_size = 1024
+_ds_cache = OrderedDict()
 def _ds_load(obj):
 	n = unicode(obj)
-	if n not in _ds_cache:
-		_ds_cache[n] = blob.load(obj._name('pickle'), obj.jobid)
-		_ds_cache.update(_ds_cache[n].get('cache', ()))
-	return _ds_cache[n]
+	if n in _ds_cache:
+		res = _ds_cache.pop(n)
+	else:
+		res = blob.load(obj._name('pickle'), obj.jobid)
+		for k, v in res.get('cache', ()):
+			if k not in _ds_cache:
+				_ds_cache[k] = v
+	_ds_cache[n] = res
+	while len(_ds_cache) > _ds_cache_size:
+		_ds_cache.popitem(last=False)
+	return res
+
+def _ds_data(obj):
+	data = DotDict(_ds_load(obj))
+	assert data.version[0] == 2 and data.version[1] >= 2, "%s/%s: Unsupported dataset pickle version %r" % (obj.jobid, obj.name, data.version,)
+	# Older versions get the new fields as None.
+	data.columns = {k: c if isinstance(c, DatasetColumn) else DatasetColumn(*c) for k, c in data.columns.items()}
+	return data
+
+def _indexed_dataset(dsid, lines, minmax):
+	# A Dataset from the chain index, which only loads its pickle when
+	# something not in the index is needed.
+	jobid, name = dsid.split('/', 1) if '/' in dsid else (dsid, 'default',)
+	obj = unicode.__new__(Dataset, dsid if name != 'default' else jobid)
+	obj.jobid = jobid
+	obj.name = name
+	obj._summary = (lines, minmax,)
+	return obj
 
 class Dataset(unicode):
 	"""
@@ -159,7 +261,7 @@ class Dataset(unicode):
 		obj.name = uni(name or 'default')
 		if jobid is _new_dataset_marker:
 			obj._data = DotDict({
-				'version': (2, 2,),
+				'version': (2, 5,),
 				'filename': None,
 				'hashlabel': None,
 				'caption': '',
@@ -171,15 +273,19 @@ class Dataset(unicode):
 			obj.jobid = None
 		else:
 			obj.jobid = jobid
-			obj._data = DotDict(_ds_load(obj))
-			assert obj._data.version[0] == 2 and obj._data.version[1] >= 2, "%s/%s: Unsupported dataset pickle version %r" % (jobid, name, obj._data.version,)
-			obj._data.columns = dict(obj._data.columns)
+			obj._data = _ds_data(obj)
 		return obj
 
 	# Look like a string after pickling
 	def __reduce__(self):
 		return unicode, (unicode(self),)
 
+	def __getattr__(self, name):
+		if name == '_data' and '_summary' in self.__dict__:
+			self._data = _ds_data(self)
+			return self._data
+		raise AttributeError(name)
+
 	@property
 	def columns(self):
 		"""{name: DatasetColumn}"""
@@ -207,8 +313,17 @@ class Dataset(unicode):
 
 	@property
 	def lines(self):
+		if '_data' not in self.__dict__ and '_summary' in self.__dict__:
+			return self._summary[0]
 		return self._data.lines
 
+	def _minmax(self, colname):
+		"""(min, max) for colname, without loading the pickle if possible"""
+		if '_data' not in self.__dict__ and '_summary' in self.__dict__:
+			return self._summary[1][colname]
+		c = self.columns[colname]
+		return c.min, c.max
+
 	@property
 	def shape(self):
 		return (len(self.columns), sum(self.lines),)
@@ -232,37 +347,316 @@ class Dataset(unicode):
 		self.name = uni(name)
 		self._save()
 
-	def _column_iterator(self, sliceno, col, **kw):
-		from sourcedata import type2iter
+	def _column_iterator(self, sliceno, col, start_row=0, stop_row=None, **kw):
+		from sourcedata import type2iter, open_column
 		dc = self.columns[col]
-		mkiter = partial(type2iter[dc.type], **kw)
+		reader = type2iter[dc.type]
+		if sidecar_type(dc.type):
+			# These open their files (there are several) themselves.
+			def mkiter(fn, codec, **more):
+				return reader(fn, codec=codec, **dict(kw, **more))
+		else:
+			mkiter = partial(open_column, partial(reader, **kw))
+		codec = dc.codec
 		def one_slice(sliceno):
 			fn = self.column_filename(col, sliceno)
+			if self._grouped(col):
+				from itertools import chain
+				stop = self.lines[sliceno] if stop_row is None else min(stop_row, self.lines[sliceno])
+				blocks = self._group_blocks(sliceno, col, start_row, stop)
+				it = chain.from_iterable(mkiter(fn, codec, seek=offset, max_count=count) for _, offset, count in blocks)
+				if blocks and start_row > blocks[0][0]:
+					it = islice(it, start_row - blocks[0][0], None)
+				return it
+			if start_row or stop_row is not None:
+				lines = self.lines[sliceno]
+				stop = lines if stop_row is None else min(stop_row, lines)
+				if start_row >= stop:
+					return iter(())
+				block_row, block_offset = self._block_start(sliceno, col, start_row)
+				if dc.offsets:
+					block_offset += dc.offsets[sliceno]
+				it = mkiter(fn, codec, seek=block_offset, max_count=stop - block_row)
+				if start_row > block_row:
+					it = islice(it, start_row - block_row, None)
+				return it
 			if dc.offsets:
-				return mkiter(fn, seek=dc.offsets[sliceno], max_count=self.lines[sliceno])
+				return mkiter(fn, codec, seek=dc.offsets[sliceno], max_count=self.lines[sliceno])
 			else:
-				return mkiter(fn)
+				return mkiter(fn, codec)
 		if sliceno is None:
+			assert not start_row and stop_row is None, "Row limits need a sliceno"
 			from g import SLICES
 			from itertools import chain
 			return chain(*[one_slice(s) for s in range(SLICES)])
 		else:
 			return one_slice(sliceno)
 
-	def _iterator(self, sliceno, columns=None):
+	def _iterator(self, sliceno, columns=None, start_row=0, stop_row=None, runs=None):
 		res = []
 		not_found = []
 		for col in columns or sorted(self.columns):
 			if col in self.columns:
-				res.append(self._column_iterator(sliceno, col))
+				if runs is None:
+					res.append(self._column_iterator(sliceno, col, start_row, stop_row))
+				else:
+					res.append(self._runs_iterator(sliceno, col, runs))
 			else:
 				not_found.append(col)
 		assert not not_found, 'Columns %r not found in %s/%s' % (not_found, self.jobid, self.name)
 		return res
 
 	def _hashfilter(self, sliceno, hashlabel, it):
+		from itertools import chain
+		plan = self._rehash_plan(sliceno, hashlabel)
+		selectors = chain.from_iterable(islice(chain.from_iterable(imap(_bit_table.__getitem__, bitmap)), lines) for bitmap, lines in izip(plan, self.lines))
+		return compress(it, selectors)
+
+	def _rehash_plan(self, sliceno, hashlabel):
+		"""[bitmap, ...] per slice with the rows that belong in sliceno when
+		hashing on hashlabel. Computed once per process (and kept in
+		memory), so rehashing again doesn't need to read (or hash) the
+		hashlabel column. The other columns are still read from every
+		source slice, the plan only picks the rows."""
+		from itertools import count
 		from g import SLICES
-		return compress(it, self._column_iterator(None, hashlabel, hashfilter=(sliceno, SLICES)))
+		key = (unicode(self), hashlabel, sliceno, SLICES,)
+		if key not in _rehash_plans:
+			plan = []
+			for src_sliceno in builtins.range(SLICES):
+				bitmap = bytearray((self.lines[src_sliceno] + 7) // 8)
+				for ix in compress(count(), self._column_iterator(src_sliceno, hashlabel, hashfilter=(sliceno, SLICES))):
+					bitmap[ix >> 3] |= 1 << (ix & 7)
+				plan.append(bitmap)
+			_rehash_plans[key] = plan
+		return _rehash_plans[key]
+
+	def _block_index(self, sliceno, colname):
+		"""The block index for colname in sliceno, or None"""
+		dc = self.columns[colname]
+		if not dc.index:
+			return None
+		if '_block_indexes' not in self.__dict__:
+			self._block_indexes = {}
+		key = (colname, sliceno,)
+		if key not in self._block_indexes:
+			# Grouped columns share the index file, so that is loaded once.
+			file_key = (dc.index, sliceno, None,)
+			if file_key not in self._block_indexes:
+				jid, path = dc.index.split('/', 1)
+				self._block_indexes[file_key] = blob.load(path % (sliceno,), jid)
+			index = self._block_indexes[file_key]
+			if self._grouped(colname):
+				index = {k: v if k == 'rows' else v[dc.name] for k, v in index.items()}
+			self._block_indexes[key] = index
+		return self._block_indexes[key]
+
+	def _grouped(self, colname):
+		return colname in self._data.get('groups', ())
+
+	def _group_blocks(self, sliceno, colname, start_row, stop_row):
+		"""[(first row, byte offset, rows), ...] for the blocks of a grouped
+		column that have rows in start_row:stop_row (limited to that)."""
+		index = self._block_index(sliceno, colname)
+		rows = index['rows'] + [self.lines[sliceno]]
+		res = []
+		for ix, offset in enumerate(index['offsets']):
+			if rows[ix + 1] <= start_row:
+				continue
+			if rows[ix] >= stop_row:
+				break
+			res.append((rows[ix], offset, min(rows[ix + 1], stop_row) - rows[ix],))
+		return res
+
+	def _bloom_may_contain(self, sliceno, keys, hashes=None):
+		"""False if the Bloom filters say no value in keys ({colname: [value, ...]})
+		can be in sliceno (or any slice if sliceno is None). hashes is
+		{(colname, type): [hash, ...]} for the values, filled in as needed
+		(pass the same dict for all datasets in a chain)."""
+		from gzwrite import bloom_check
+		if '_blooms' not in self.__dict__:
+			self._blooms = {}
+		if hashes is None:
+			hashes = {}
+		if sliceno is None:
+			from g import SLICES
+			return any(self._bloom_may_contain(ix, keys, hashes) for ix in builtins.range(SLICES))
+		for colname, values in keys.items():
+			dc = self.columns.get(colname)
+			if not dc or not dc.bloom:
+				continue
+			hkey = (colname, dc.type,)
+			if hkey not in hashes:
+				hashes[hkey] = _bloom_hashes(dc.type, values)
+			if hashes[hkey] is None:
+				continue
+			key = (colname, sliceno,)
+			if key not in self._blooms:
+				jid, path = dc.bloom.split('/', 1)
+				try:
+					self._blooms[key] = blob.load(path % (sliceno,), jid)
+				except IOError:
+					self._blooms[key] = None
+			bloom = self._blooms[key]
+			if not bloom or not any(bloom['bits']):
+				continue # missing or empty filter, can't rule anything out
+			if not any(bloom_check(bloom, h) for h in hashes[hkey]):
+				return False
+		return True
+
+	def _block_start(self, sliceno, colname, row):
+		"""(first row, byte offset) of the block containing row (0, 0 for unindexed columns)"""
+		from bisect import bisect_right
+		index = self._block_index(sliceno, colname)
+		if not index:
+			return 0, 0
+		ix = bisect_right(index['rows'], row) - 1
+		return index['rows'][ix], index['offsets'][ix]
+
+	def _runs_iterator(self, sliceno, colname, runs):
+		from itertools import chain
+		return chain.from_iterable(self._column_iterator(sliceno, colname, start, stop) for start, stop in runs)
+
+	def _zone_runs(self, sliceno, colname, bottom, top, start_row=0, stop_row=None):
+		"""[(start, stop), ...] with the row ranges in sliceno that may have
+		values bottom <= v < top in colname according to the zone map, or
+		None if there is no zone map."""
+		index = self._block_index(sliceno, colname)
+		if not index or 'min' not in index:
+			return None
+		lines = self.lines[sliceno]
+		stop_row = lines if stop_row is None else min(stop_row, lines)
+		runs = []
+		for block_start, block_stop, b_min, b_max in izip(index['rows'], index['rows'][1:] + [lines], index['min'], index['max']):
+			if b_min is not None:
+				if top is not None and b_min >= top:
+					continue
+				if bottom is not None and b_max < bottom:
+					continue
+			block_start = max(block_start, start_row)
+			block_stop = min(block_stop, stop_row)
+			if block_start >= block_stop:
+				continue
+			if runs and runs[-1][1] == block_start:
+				runs[-1] = (runs[-1][0], block_stop)
+			else:
+				runs.append((block_start, block_stop))
+		return runs
+
+	def take(self, sliceno, rows, columns=None):
+		"""Get the specified rows (numbered from 0 within sliceno) as a
+		list of tuples, in the order you asked for them. If columns is
+		a single name you get just the values.
+		Columns written with block_rows only read the blocks containing
+		the rows, other columns are read up to the last row you want."""
+		want_tuple = not isinstance(columns, str_types)
+		columns = (columns or sorted(self.columns)) if want_tuple else [columns]
+		rows = list(rows)
+		lines = self.lines[sliceno]
+		wanted = sorted(set(rows))
+		if wanted and (wanted[0] < 0 or wanted[-1] >= lines):
+			raise IndexError("Rows must be in range(%d) for slice %d of %s" % (lines, sliceno, self,))
+		res = []
+		for col in columns:
+			assert col in self.columns, 'Column %r not found in %s/%s' % (col, self.jobid, self.name)
+			values = {}
+			it = None
+			for row in wanted:
+				if it is None or self._block_start(sliceno, col, row)[0] > pos:
+					# new block, start reading there instead of skipping
+					it = self._column_iterator(sliceno, col, row)
+					pos = row
+				values[row] = next(islice(it, row - pos, None))
+				pos = row + 1
+			res.append([values[row] for row in rows])
+		if want_tuple:
+			return list(izip(*res))
+		else:
+			return res[0]
+
+	def _array_iterator(self, sliceno, col, chunk_rows):
+		from sourcedata import array_reader
+		dc = self.columns[col]
+		codec = dc.codec
+		def one_slice(sliceno):
+			fn = self.column_filename(col, sliceno)
+			if self._grouped(col):
+				from itertools import chain
+				blocks = self._group_blocks(sliceno, col, 0, self.lines[sliceno])
+				return chain.from_iterable(array_reader(dc.type, fn, offset, count, chunk_rows, codec) for _, offset, count in blocks)
+			seek = dc.offsets[sliceno] if dc.offsets else 0
+			return array_reader(dc.type, fn, seek, self.lines[sliceno], chunk_rows, codec)
+		if sliceno is None:
+			from g import SLICES
+			from itertools import chain
+			return chain(*[one_slice(s) for s in range(SLICES)])
+		else:
+			return one_slice(sliceno)
+
+	def column_array(self, sliceno, colname):
+		"""All values from colname in sliceno (or all slices if None) as
+		one numpy array, without making a python object per value.
+		Only fixed width types are supported (see sourcedata.type2array),
+		temporal types become datetime64/timedelta64.
+		Dictionary encoded columns give the codes, see .column_dictionary.
+		Columns written with compression='raw' are mmaped (read-only)."""
+		import numpy as np
+		from sourcedata import type2array
+		assert colname in self.columns, 'Column %r not found in %s/%s' % (colname, self.jobid, self.name)
+		lines = sum(self.lines) if sliceno is None else self.lines[sliceno]
+		chunks = list(self._array_iterator(sliceno, colname, max(lines, 1)))
+		if len(chunks) == 1:
+			return chunks[0]
+		elif chunks:
+			return np.concatenate(chunks)
+		else:
+			return type2array[self.columns[colname].type][1](np, b'')
+
+	def column_dictionary(self, sliceno, colname):
+		"""The values of a dictionary encoded column (like "ascii:dict") in
+		sliceno, indexed by the codes .column_array gives you for it.
+		(Code 0 is None.) Each slice has its own dictionary."""
+		from extras import pickle_load
+		from gzwrite import dict_type
+		assert dict_type(self.columns[colname].type), "%s is not a dictionary encoded column" % (colname,)
+		return pickle_load(self.column_filename(colname, sliceno) + '.dict')
+
+	def column_heap(self, sliceno, colname):
+		"""(offsets, heap, nulls) for a heap string column (like "ascii:heap")
+		in sliceno. Value i is heap[offsets[i]:offsets[i + 1]] (as bytes),
+		and None where nulls[i]. offsets and nulls are numpy arrays, heap is
+		mmaped for raw compression, so memoryview(heap)[a:b] doesn't copy.
+		With gzip compression the whole heap is decompressed into memory
+		(iterating the column doesn't do that), so use raw compression
+		for big heap columns you want to use this on."""
+		from sourcedata import heap_arrays
+		from gzwrite import heap_type
+		dc = self.columns[colname]
+		assert heap_type(dc.type), "%s is not a heap string column" % (colname,)
+		return heap_arrays(self.column_filename(colname, sliceno), self.lines[sliceno], dc.codec)
+
+	def column_lists(self, sliceno, colname):
+		"""(offsets, values, nulls) for a flat list column (like "list:int64")
+		in sliceno. Row i is values[offsets[i]:offsets[i + 1]], and None
+		where nulls[i]. All are numpy arrays, so only fixed width value
+		types are supported (see .column_array)."""
+		from sourcedata import list_arrays
+		from gzwrite import flat_list_type
+		dc = self.columns[colname]
+		assert flat_list_type(dc.type), "%s is not a flat list column" % (colname,)
+		return list_arrays(dc.type, self.column_filename(colname, sliceno), self.lines[sliceno], dc.codec)
+
+	def iterate_arrays(self, sliceno, columns=None, chunk_rows=65536):
+		"""Like .iterate, but gives numpy arrays of (up to) chunk_rows
+		values per column. You get tuples with one array per column,
+		or just the arrays if you pass a single name (a str) as columns.
+		Only fixed width types are supported, see .column_array."""
+		if isinstance(columns, str_types):
+			return self._array_iterator(sliceno, columns, chunk_rows)
+		columns = columns or sorted(self.columns)
+		not_found = [col for col in columns if col not in self.columns]
+		assert not not_found, 'Columns %r not found in %s/%s' % (not_found, self.jobid, self.name)
+		return izip(*[self._array_iterator(sliceno, col, chunk_rows) for col in columns])
 
 	def column_filename(self, colname, sliceno=None):
 		dc = self.columns[colname]
@@ -281,27 +675,55 @@ class Dataset(unicode):
 			if stop_jobid:
 				stop_jobid = stop_jobid.jobid
 		chain = []
-		current = self
-		while length != len(chain) and current.jobid != stop_jobid:
-			chain.append(current)
-			if not current.previous:
+		for current in self._walk_chain():
+			if length == len(chain) or current.jobid == stop_jobid:
 				break
-			current = Dataset(current.previous)
+			chain.append(current)
 		if not reverse:
 			chain.reverse()
 		return chain
 
-	def iterate_chain(self, sliceno, columns=None, length=-1, range=None, sloppy_range=False, reverse=False, hashlabel=None, stop_jobid=None, pre_callback=None, post_callback=None, filters=None, translators=None):
+	def _walk_chain(self):
+		"""Yields self, previous, previous.previous and so on, using the
+		chain index where there is one."""
+		current = self
+		while current:
+			yield current
+			index = current._chain_index()
+			if index:
+				for dsid, lines, minmax in index['entries'][1:]:
+					yield _indexed_dataset(dsid, lines, minmax)
+				current = index['base'] and Dataset(index['base'])
+			else:
+				current = current.previous and Dataset(current.previous)
+
+	def _chain_index(self):
+		try:
+			return blob.load(self._name('chain'), self.jobid)
+		except IOError:
+			return None
+
+	def _update_chain_index(self):
+		entry = (unicode(self), self.lines, {k: (c.min, c.max,) for k, c in self.columns.items()},)
+		previous = Dataset(self.previous)
+		index = previous._chain_index()
+		if index and len(index['entries']) < _chain_index_span:
+			index = {'entries': [entry] + index['entries'], 'base': index['base']}
+		else:
+			index = {'entries': [entry], 'base': unicode(previous)}
+		blob.save(index, self._name('chain'), temp=False)
+
+	def iterate_chain(self, sliceno, columns=None, length=-1, range=None, sloppy_range=False, reverse=False, hashlabel=None, stop_jobid=None, pre_callback=None, post_callback=None, filters=None, translators=None, batch_size=None, batch_columns=False, prefetch=False):
 		"""Iterate a list of datasets. See .chain and .iterate_list for details."""
 		chain = self.chain(length, reverse, stop_jobid)
-		return self.iterate_list(sliceno, columns, chain, range=range, sloppy_range=sloppy_range, hashlabel=hashlabel, pre_callback=pre_callback, post_callback=post_callback, filters=filters, translators=translators)
+		return self.iterate_list(sliceno, columns, chain, range=range, sloppy_range=sloppy_range, hashlabel=hashlabel, pre_callback=pre_callback, post_callback=post_callback, filters=filters, translators=translators, batch_size=batch_size, batch_columns=batch_columns, prefetch=prefetch)
 
-	def iterate(self, sliceno, columns=None, hashlabel=None, filters=None, translators=None):
+	def iterate(self, sliceno, columns=None, hashlabel=None, filters=None, translators=None, batch_size=None, batch_columns=False, start_row=0, stop_row=None, prefetch=False):
 		"""Iterate just this dataset. See .iterate_list for details."""
-		return self.iterate_list(sliceno, columns, [self], hashlabel=hashlabel, filters=filters, translators=translators)
+		return self.iterate_list(sliceno, columns, [self], hashlabel=hashlabel, filters=filters, translators=translators, batch_size=batch_size, batch_columns=batch_columns, start_row=start_row, stop_row=stop_row, prefetch=prefetch)
 
 	@staticmethod
-	def iterate_list(sliceno, columns, jobids, range=None, sloppy_range=False, hashlabel=None, pre_callback=None, post_callback=None, filters=None, translators=None):
+	def iterate_list(sliceno, columns, jobids, range=None, sloppy_range=False, hashlabel=None, pre_callback=None, post_callback=None, filters=None, translators=None, batch_size=None, batch_columns=False, start_row=0, stop_row=None, prefetch=False):
 		"""Iterator over the specified columns from jobids (str or list)
 		callbacks are called before and after each dataset is iterated.
 
@@ -315,6 +737,17 @@ class Dataset(unicode):
 		filters={'some_col': some_set.__contains__}
 		filters={'some_col': some_str.__eq__}
 		filters=lambda line: line[0] == line[1]
+		some_set.__contains__ filters on columns with Bloom filters (see
+		DatasetWriter) skip the slices that can't have any of the values.
+
+		Filters in a dict can also be declarative:
+		('eq', v), ('in', values), ('between', start, stop) (start <= v < stop,
+		either can be None), ('isnull',), ('not', filter),
+		('and', filter, filter, ...) and ('or', filter, filter, ...).
+		These are compiled into the row filter (no function call per value)
+		and datasets whose min/max (or Bloom filters, for eq/in) say nothing
+		can match are skipped without being read.
+		filters={'some_col': ('in', some_set), 'other_col': ('between', 1, 10)}
 
 		translators transform data values. It can be a callable (called with the
 		candidate tuple and expected to return a tuple of the same length) or a
@@ -335,6 +768,28 @@ class Dataset(unicode):
 		only rows where start <= colvalue < stop will be returned.
 		If you set sloppy_range=True you may get all rows from datasets that
 		contain any rows you asked for. (This can be faster.)
+		In datasets written with block_rows only the blocks whose min/max
+		overlap the range are read (as long as all the columns you want
+		have a block index).
+
+		batch_size=N gives you lists of (up to) N rows instead of one row
+		at a time. Batches never span more than one dataset slice. With
+		batch_columns=True each batch is a list with one list of values
+		per column instead. Everything above still applies, but without
+		row level filtering/translation/rehashing the columns are read a
+		whole batch at a time, which avoids most of the per row overhead.
+
+		start_row and stop_row limit iteration to those rows (numbered
+		from 0, stop_row not included) of each dataset slice. Columns
+		written with block_rows can start reading at the right block,
+		other columns have to skip the rows before start_row.
+		Not supported when rehashing.
+
+		prefetch=True reads (and decompresses) each column in a helper
+		thread, a bit ahead of where you are, and starts on the next
+		dataset slice before you get there. This helps when you are
+		using many columns, or doing enough work per row that reading
+		could happen in parallel. It uses two threads per column.
 		"""
 
 		if isinstance(jobids, Dataset):
@@ -360,14 +815,19 @@ class Dataset(unicode):
 			range_k, (range_bottom, range_top,) = next(iteritems(range))
 			if range_bottom is None and range_top is None:
 				range = None
+		predicates = {}
+		if filters and not callable(filters) and not callable(translators):
+			predicates = {name: f for name, f in filters.items() if isinstance(f, tuple) and name not in (translators or ())}
 		for d in datasets:
 			if sum(d.lines) == 0:
 				continue
+			if predicates and not all(predicate_may_match(f, *d._minmax(name)) for name, f in predicates.items()):
+				continue
 			if range:
-				c = d.columns[range_k]
-				if range_top is not None and c.min >= range_top:
+				c_min, c_max = d._minmax(range_k)
+				if range_top is not None and c_min >= range_top:
 					continue
-				if range_bottom is not None and c.max < range_bottom:
+				if range_bottom is not None and c_max < range_bottom:
 					continue
 			jobid = d.split('/')[0]
 			if sliceno is None:
@@ -380,12 +840,37 @@ class Dataset(unicode):
 				else:
 					rehash = False
 				to_iter.append((jobid, d, sliceno, rehash,))
+		if filters and not callable(filters):
+			bloom_keys = Dataset._bloom_keys(filters, translators)
+			if bloom_keys:
+				hashes = {}
+				to_iter = [t for t in to_iter if t[1]._bloom_may_contain(None if t[3] else t[2], bloom_keys, hashes)]
 		filter_func = Dataset._resolve_filters(columns, filters)
 		translation_func, translators = Dataset._resolve_translators(columns, translators)
 		if sloppy_range:
 			range = None
 		from itertools import chain
-		return chain.from_iterable(Dataset._iterate_datasets(to_iter, columns, pre_callback, post_callback, filter_func, translation_func, translators, want_tuple, range))
+		return chain.from_iterable(Dataset._iterate_datasets(to_iter, columns, pre_callback, post_callback, filter_func, translation_func, translators, want_tuple, range, batch_size, batch_columns, start_row, stop_row, prefetch))
+
+	@staticmethod
+	def _bloom_keys(filters, translators):
+		"""{colname: [value, ...]} for the filters that are membership tests
+		(some_set.__contains__, ('eq', v) or ('in', values)) on untranslated
+		columns."""
+		res = {}
+		for name, f in filters.items():
+			if translators and (callable(translators) or name in translators):
+				continue
+			if isinstance(f, tuple) and f[0] in ('eq', 'in',):
+				container = [f[1]] if f[0] == 'eq' else f[1]
+			else:
+				container = getattr(f, '__self__', None)
+				if getattr(f, '__name__', None) != '__contains__' or not isinstance(container, (set, frozenset, dict)):
+					continue
+			if None in container:
+				continue # None is not in the filters
+			res[name] = list(container)
+		return res
 
 	@staticmethod
 	def _resolve_filters(columns, filters):
@@ -396,17 +881,24 @@ class Dataset(unicode):
 			fs = []
 			arg_n = []
 			arg_v = []
+			consts = {}
 			for ix, f in filters:
 				if f is None or f is bool:
 					# use value directly
 					fs.append('t[%d]' % (ix,))
+				elif isinstance(f, tuple):
+					# declarative, goes directly in the lambda
+					fs.append(predicate_expression(f, 't[%d]' % (ix,), consts))
 				else:
 					n = 'f%d' % (ix,)
 					arg_n.append(n)
 					arg_v.append(f)
 					fs.append('%s(t[%d])' % (n, ix,))
 			f = 'lambda t: ' + ' and '.join(fs)
-			# Add another lambda to put all fN into local variables.
+			for n, v in sorted(consts.items()):
+				arg_n.append(n)
+				arg_v.append(v)
+			# Add another lambda to put all fN (and pN) into local variables.
 			# (This is faster than putting them in "locals", you get
 			# LOAD_DEREF instead of LOAD_GLOBAL.)
 			f = 'lambda %s: %s' % (', '.join(arg_n), f)
@@ -429,7 +921,7 @@ class Dataset(unicode):
 			return None, res
 
 	@staticmethod
-	def _iterate_datasets(to_iter, columns, pre_callback, post_callback, filter_func, translation_func, translators, want_tuple, range):
+	def _iterate_datasets(to_iter, columns, pre_callback, post_callback, filter_func, translation_func, translators, want_tuple, range, batch_size, batch_columns, start_row, stop_row, prefetch):
 		skip_jobid = None
 		def argfixup(func, is_post):
 			if func:
@@ -461,61 +953,112 @@ class Dataset(unicode):
 					range_f = range_check
 			else:
 				has_range_column = False
+		def open_slice(d, sliceno, rehash):
+			assert not rehash or (not start_row and stop_row is None), "Can't limit rows when rehashing"
+			if range:
+				c = d.columns[range_k]
+				filter_range = c.min is not None and (not range_check(c.min) or not range_check(c.max))
+			else:
+				filter_range = False
+			runs = None
+			if filter_range and not rehash and all(d.columns[col].index for col in columns):
+				# Only read the blocks that the zone map says may match.
+				runs = d._zone_runs(sliceno, range_k, range_bottom, range_top, start_row, stop_row)
+			it = d._iterator(None if rehash else sliceno, columns, start_row, stop_row, runs)
+			if prefetch:
+				it = [_ReadAhead(c) for c in it]
+			return it, filter_range, runs
+		def close_ahead():
+			if ahead:
+				for c in ahead[1][0]:
+					c.close()
+		ahead = None
+		current = ()
 		starting_at = '%s:%d' % (to_iter[0][0], to_iter[0][2],)
 		if len(to_iter) == 1:
 			msg = 'Iterating ' + starting_at
 		else:
 			msg = 'Iterating %d dataset slices starting at %s' % (len(to_iter), starting_at,)
 		with status(msg):
-			for ix, (jobid, d, sliceno, rehash) in enumerate(to_iter):
-				if unsliced_post_callback:
-					post_callback(jobid)
-				if pre_callback:
-					if jobid == skip_jobid:
-						continue
-					try:
-						pre_callback(jobid, sliceno)
-					except SkipSlice:
-						if unsliced_pre_callback:
+			try:
+				for ix, (jobid, d, sliceno, rehash) in enumerate(to_iter):
+					if unsliced_post_callback:
+						post_callback(jobid)
+					if pre_callback:
+						if jobid == skip_jobid:
+							continue
+						try:
+							pre_callback(jobid, sliceno)
+						except SkipSlice:
+							if unsliced_pre_callback:
+								skip_jobid = jobid
+							continue
+						except SkipJob:
 							skip_jobid = jobid
-						continue
-					except SkipJob:
-						skip_jobid = jobid
-						continue
-				it = d._iterator(None if rehash else sliceno, columns)
-				for ix, trans in translators.items():
-					it[ix] = imap(trans, it[ix])
-				if want_tuple:
-					it = izip(*it)
-				else:
-					it = it[0]
-				if rehash:
-					it = d._hashfilter(sliceno, rehash, it)
-				if translation_func:
-					it = imap(translation_func, it)
-				if range:
-					c = d.columns[range_k]
-					if c.min is not None and (not range_check(c.min) or not range_check(c.max)):
-						if has_range_column:
-							it = ifilter(range_f, it)
+							continue
+					if ahead and ahead[0] == ix:
+						it, filter_range, runs = ahead[1]
+						ahead = None
+					else:
+						close_ahead()
+						ahead = None
+						it, filter_range, runs = open_slice(d, sliceno, rehash)
+					if prefetch:
+						current = it
+						if ix + 1 < len(to_iter) and to_iter[ix + 1][0] != skip_jobid:
+							_, n_d, n_sliceno, n_rehash = to_iter[ix + 1]
+							ahead = (ix + 1, open_slice(n_d, n_sliceno, n_rehash))
+						it = [iter(c) for c in it]
+					for ix, trans in translators.items():
+						it[ix] = imap(trans, it[ix])
+					if batch_size and not (rehash or translation_func or filter_range or filter_func):
+						it = _column_batches(it, batch_size, want_tuple, batch_columns)
+					else:
+						if want_tuple:
+							it = izip(*it)
 						else:
-							if rehash:
-								filter_it = d._hashfilter(sliceno, rehash, d._column_iterator(None, range_k))
+							it = it[0]
+						if rehash:
+							it = d._hashfilter(sliceno, rehash, it)
+						if translation_func:
+							it = imap(translation_func, it)
+						if filter_range:
+							if has_range_column:
+								it = ifilter(range_f, it)
 							else:
-								filter_it = d._column_iterator(sliceno, range_k)
-							it = compress(it, imap(range_check, filter_it))
-				if filter_func:
-					it = ifilter(filter_func, it)
-				with status('(%d/%d) %s:%s' % (ix, len(to_iter), jobid, 'REHASH' if rehash else sliceno,)):
-					yield it
-				if post_callback and not unsliced_post_callback:
-					post_callback(jobid, sliceno)
-			if unsliced_post_callback:
-				post_callback(None)
+								if rehash:
+									filter_it = d._hashfilter(sliceno, rehash, d._column_iterator(None, range_k))
+								elif runs is not None:
+									filter_it = d._runs_iterator(sliceno, range_k, runs)
+								else:
+									filter_it = d._column_iterator(sliceno, range_k, start_row, stop_row)
+								if prefetch:
+									filter_it = _ReadAhead(filter_it)
+									current.append(filter_it)
+								it = compress(it, imap(range_check, filter_it))
+						if filter_func:
+							it = ifilter(filter_func, it)
+						if batch_size:
+							it = _row_batches(it, batch_size, want_tuple, batch_columns)
+					with status('(%d/%d) %s:%s' % (ix, len(to_iter), jobid, 'REHASH' if rehash else sliceno,)):
+						yield it
+					if post_callback and not unsliced_post_callback:
+						post_callback(jobid, sliceno)
+				if unsliced_post_callback:
+					post_callback(None)
+			finally:
+				close_ahead()
+				for c in current:
+					c.close()
 
 	@staticmethod
-	def new(columns, filenames, lines, minmax={}, filename=None, hashlabel=None, caption=None, previous=None, name='default'):
-		"""columns = {"colname": "type"}, lines = [n, ...] or {sliceno: n}"""
+	def new(columns, filenames, lines, minmax={}, filename=None, hashlabel=None, caption=None, previous=None, name='default', compression=None, indexed=False, bloom=(), deferred=False, groups={}):
+		"""columns = {"colname": "type"}, lines = [n, ...] or {sliceno: n}
+		compression is what the column files were written with (see gzwrite.codecs)
+		indexed means there are block indexes next to the column files
+		bloom is the columns that have Bloom filters next to the column files
+		deferred means the column files are not compressed yet (see compress_deferred)
+		groups is {"colname": "group file name"} for grouped columns (see DatasetWriter)"""
 		columns = {uni(k): uni(v) for k, v in columns.items()}
 		if hashlabel:
 			hashlabel = uni(hashlabel)
@@ -523,7 +1066,7 @@ class Dataset(unicode):
 		res = Dataset(_new_dataset_marker, name)
 		res._data.lines = list(Dataset._linefixup(lines))
 		res._data.hashlabel = hashlabel
-		res._append(columns, filenames, minmax, filename, caption, previous, name)
+		res._append(columns, filenames, minmax, filename, caption, previous, name, compression, indexed, bloom, deferred, groups)
 		return res
 
 	@staticmethod
@@ -535,14 +1078,14 @@ class Dataset(unicode):
 		assert len(lines) == SLICES, "Lines must be specified for all slices"
 		return lines
 
-	def append(self, columns, filenames, lines, minmax={}, filename=None, hashlabel=None, hashlabel_override=False, caption=None, previous=None, name='default'):
+	def append(self, columns, filenames, lines, minmax={}, filename=None, hashlabel=None, hashlabel_override=False, caption=None, previous=None, name='default', compression=None, indexed=False, bloom=(), deferred=False, groups={}):
 		if hashlabel:
 			hashlabel = uni(hashlabel)
 			if not hashlabel_override:
 				assert self.hashlabel == hashlabel, 'Hashlabel mismatch %s != %s' % (self.hashlabel, hashlabel,)
 		assert self._linefixup(lines) == self.lines, "New columns don't have the same number of lines as parent columns"
 		columns = {uni(k): uni(v) for k, v in columns.items()}
-		self._append(columns, filenames, minmax, filename, caption, previous, name)
+		self._append(columns, filenames, minmax, filename, caption, previous, name, compression, indexed, bloom, deferred, groups)
 
 	def _minmax_merge(self, minmax):
 		def minmax_fixup(a, b):
@@ -560,13 +1103,17 @@ class Dataset(unicode):
 					res[name] = [min(mm[0], omm[0]), max(mm[1], omm[1])]
 		return res
 
-	def _append(self, columns, filenames, minmax, filename, caption, previous, name):
+	def _append(self, columns, filenames, minmax, filename, caption, previous, name, compression, indexed, bloom, deferred, groups):
 		from sourcedata import type2iter
+		from gzwrite import compression_mode
 		from g import JOBID
+		codec = uni(compression_mode(compression)[0])
 		jobid = uni(JOBID)
 		name = uni(name)
 		filenames = {uni(k): uni(v) for k, v in filenames.items()}
 		assert set(columns) == set(filenames), "columns and filenames don't have the same keys"
+		bloom = set(uni(n) for n in bloom)
+		assert bloom <= set(columns), "Bloom filter for unknown column(s) %r" % (bloom - set(columns),)
 		if self.jobid and (self.jobid != jobid or self.name != name):
 			self._data.parent = '%s/%s' % (self.jobid, self.name,)
 		self.jobid = jobid
@@ -577,19 +1124,42 @@ class Dataset(unicode):
 		for n in ('cache', 'cache_distance'):
 			if n in self._data: del self._data[n]
 		minmax = self._minmax_merge(minmax)
+		pending = dict(self._data.get('deferred', ()))
+		for n in columns:
+			if deferred:
+				pending[n] = uni(compression or 'gzip')
+			else:
+				pending.pop(n, None)
+		if pending:
+			self._data.deferred = pending
+		elif 'deferred' in self._data:
+			del self._data.deferred
+		groups = {uni(k): uni(v) for k, v in groups.items()}
+		assert not groups or indexed, "Grouped columns need a block index"
+		grouped = {k: v for k, v in self._data.get('groups', {}).items() if k not in columns}
+		grouped.update(groups)
+		if grouped:
+			self._data.groups = grouped
+		elif 'groups' in self._data:
+			del self._data.groups
 		for n, t in sorted(columns.items()):
 			if t not in type2iter:
 				raise Exception('Unknown type %s on column %s' % (t, n,))
 			mm = minmax.get(n, (None, None,))
+			fn = groups.get(n, filenames[n])
 			self._data.columns[n] = DatasetColumn(
 				type=uni(t),
 				name=filenames[n],
-				location='%s/%s/%%s.%s' % (jobid, self.name, filenames[n]),
+				location='%s/%s/%%s.%s' % (jobid, self.name, fn),
 				min=mm[0],
 				max=mm[1],
 				offsets=None,
+				codec=codec,
+				index='%s/%s/%%s.%s.idx' % (jobid, self.name, fn) if indexed else None,
+				bloom='%s/%s/%%s.%s.bloom' % (jobid, self.name, filenames[n]) if n in bloom else None,
 			)
-			self._maybe_merge(n)
+			if n not in groups:
+				self._maybe_merge(n)
 		self._update_caches()
 		self._save()
 
@@ -605,7 +1175,12 @@ class Dataset(unicode):
 
 	def _maybe_merge(self, n):
 		from g import SLICES
-		if SLICES < 2:
+		if SLICES < 2 or n in self._data.get('deferred', ()):
+			# (deferred files are compressed one by one later.)
+			return
+		from gzwrite import sidecar_type
+		if sidecar_type(self._data.columns[n].type):
+			# the dictionaries (or offsets) are found next to the slice files.
 			return
 		fn = self.column_filename(n)
 		sizes = [os.path.getsize(fn % (sliceno,)) for sliceno in range(SLICES)]
@@ -632,6 +1207,8 @@ class Dataset(unicode):
 		if not os.path.exists(self.name):
 			os.mkdir(self.name)
 		blob.save(self._data, self._name('pickle'), temp=False)
+		if self.previous:
+			self._update_chain_index()
 		with open(self._name('txt'), 'w', encoding='utf-8') as fh:
 			nl = False
 			if self.hashlabel:
@@ -657,6 +1234,23 @@ _datasetwriters = {}
 
 _nodefault = object()
 
+def _unparsed(typename):
+	# "parsed:int64" is written as an int64 column. (Other types can have
+	# a ":" too, like "ascii:dict".)
+	if typename.startswith('parsed:'):
+		return typename[7:]
+	return typename
+
+def _bloom_hashes(typename, values):
+	"""[hash, ...] for values, the way a typename writer (so GzWriteBloom)
+	hashes them. None if some value is not valid for the type (it might
+	still compare equal to a value in the column, 1.0 == 1)."""
+	h = typed_writer(typename)(os.devnull).hash
+	try:
+		return [h(v) for v in values]
+	except (TypeError, ValueError, OverflowError):
+		return None
+
 class DatasetWriter(object):
 	"""
 	Create in prepare, use in analysis. Or do the whole thing in
@@ -676,6 +1270,17 @@ class DatasetWriter(object):
 	sorted order if you passed a dict). The dw.write() function names the
 	arguments from the columns too.
 	
+	If you have whole columns of values (lists, numpy arrays, ...) you can
+	write them all in one call with
+	
+	dw.write_arrays({column: values})
+	dw.write_columns(values, values, ...)
+	
+	which is a lot faster than writing them one row at a time. There is
+	a splitting version of this too, dw.split_write_columns (and
+	dw.split_write_arrays), which hashes the whole hashlabel column at
+	once and writes each slice's rows in one go.
+	
 	If you set hashlabel you can use dw.hashcheck(v) to check if v
 	belongs in this slice. You can also just call the writer, and it will
 	discard anything that does not belong in this slice.
@@ -706,11 +1311,92 @@ class DatasetWriter(object):
 	In this case you also need to call dw.set_lines(sliceno, count)
 	before finishing. You should also call
 	dw.set_minmax(sliceno, {colname: (min, max)}) if you can.
+
+	compression selects how the column files are compressed, 'gzip'
+	(default) or 'gzip:level', 'raw' (uncompressed, cheap to write and
+	read, good for intermediate datasets), or 'bz2'/'lzma' (small but
+	slow, for cold data, lzma needs python 3). See gzwrite.codecs.
+	With meta_only you have to write the files in the specified format
+	yourself.
+
+	block_rows=N (e.g. 65536) writes the columns in independently
+	readable blocks of N rows, with an index. This allows ds.take and
+	iterate(start_row=...) to skip to the right block. It costs a bit
+	of compression and an extra python call per value written, and is
+	only available with gzip or raw compression.
+
+	bloom=[colname, ...] builds a per slice Bloom filter for those
+	columns. Iterating with filters={colname: some_set.__contains__}
+	then skips slices (and whole datasets) where none of the values in
+	some_set can be. Good for looking up a few keys in a long chain. It
+	costs an extra python call per value written and memory for all
+	distinct values in the slice while writing.
+
+	Columns of type "ascii:dict", "bytes:dict" or "unicode:dict" are
+	dictionary encoded: each slice stores its distinct values once and
+	an int32 code per row. Much smaller (and faster to read) for columns
+	with few distinct values, and the values come back as shared
+	objects. Not with block_rows or bz2/lzma compression.
+
+	Columns of type "int64:delta", "int32:delta", "date:delta" or
+	"datetime:delta" are delta and run length encoded. Much smaller
+	for sorted or slowly changing columns (ids, timestamps), but costs
+	an extra python call per value both writing and reading.
+
+	Columns of type "ascii:heap", "bytes:heap" or "unicode:heap" store
+	the values back to back with an offset per value instead of one
+	value per line. Values can have newlines, and .column_heap gives you
+	the whole slice as numpy offsets and a buffer to slice, without
+	making python objects. Not with block_rows or bz2/lzma compression.
+
+	Columns of type "list:T" or "set:T" (for most scalar types T, see
+	gzwrite.flat_list_inner_types) store the lengths and the values
+	separately, which is a lot faster than the older "numberlist" and
+	similar types. For fixed width T .column_lists gives you a slice as
+	numpy arrays. Same restrictions as the heap strings, and they can't
+	be the hashlabel.
+
+	Columns of type "pickle" hold any picklable values, and are much
+	faster to read than "json" (and keep bytes, tuples, datetimes and so
+	on as they were).
+
+	defer_compression=True (only for gzip compression) writes the
+	columns as gzip without compression (level 0), and leaves
+	compressing them to the daemon after the job is done. This takes
+	compression off the critical path, and jobs using the dataset can
+	start right away (on the uncompressed files, which use more disk
+	until they are compressed). Not together with block_rows.
+
+	narrow_numbers=True looks at the number columns when finishing, and
+	rewrites the ones that only have ints (that fit) as int64 and the
+	ones that only have floats as float64. Those are faster to read, and
+	work with .column_array. (Not the hashlabel or bloom columns, and
+	not together with block_rows or bz2/lzma compression.)
+
+	column_groups=[[colname, ...], ...] puts each group of columns in a
+	single file per slice, instead of one file per column per slice.
+	The columns are stored interleaved in blocks (block_rows, which
+	defaults to 65536 here), and a block index per group and slice lets
+	readers go straight to the blocks of the columns they want. Good for
+	wide datasets, where the number of files is otherwise a problem. It
+	costs memory for a block of every column in the group (in every
+	slice with the split writers) while writing, and for the whole
+	slice with write_columns (which writes one column at a time). Not
+	for dictionary encoded columns, and column_filename can't be used
+	to read grouped columns.
+
+	spill_rows=N makes the split writers keep at most (about) N rows in
+	memory, spilling the rest to temporary files in the dataset
+	directory. The column files are only written when the writer is
+	closed, one slice at a time. Without this every slice has writers
+	for every column open all the time, which with many slices and
+	many columns uses a lot of memory and file descriptors.
 	"""
 
-	_split = _split_dict = _split_list = _allwriters_ = None
+	_split = _split_dict = _split_list = _allwriters_ = _spillers_ = _split_cycle_ = None
+	_split_closed = False
 
-	def __new__(cls, columns={}, filename=None, hashlabel=None, hashlabel_override=False, caption=None, previous=None, name='default', parent=None, meta_only=False, for_single_slice=None):
+	def __new__(cls, columns={}, filename=None, hashlabel=None, hashlabel_override=False, caption=None, previous=None, name='default', parent=None, meta_only=False, for_single_slice=None, compression=None, block_rows=None, bloom=(), spill_rows=None, defer_compression=False, narrow_numbers=False, column_groups=()):
 		"""columns can be {'name': 'type'} or {'name': DatasetColumn}
 		to simplify basing your dataset on another."""
 		name = uni(name)
@@ -718,10 +1404,23 @@ class DatasetWriter(object):
 		from g import running
 		if running == 'analysis':
 			assert name in _datasetwriters, 'Dataset with name "%s" not created' % (name,)
-			assert not columns and not filename and not hashlabel and not caption and not parent and for_single_slice is None, "Don't specify any arguments (except optionally name) in analysis"
+			assert not columns and not filename and not hashlabel and not caption and not parent and for_single_slice is None and not compression and not block_rows and not bloom and not spill_rows and not defer_compression and not narrow_numbers and not column_groups, "Don't specify any arguments (except optionally name) in analysis"
 			return _datasetwriters[name]
 		else:
 			assert name not in _datasetwriters, 'Duplicate dataset name "%s"' % (name,)
+			from gzwrite import compression_mode
+			codec, mode = compression_mode(compression)
+			if column_groups:
+				block_rows = block_rows or 65536
+			if block_rows:
+				assert codec in ('gzip', 'raw',), "block_rows only works with gzip or raw compression"
+				assert not meta_only, "block_rows needs the writers"
+			assert not (bloom and meta_only), "bloom needs the writers"
+			assert not (spill_rows and meta_only), "spill_rows needs the writers"
+			if defer_compression:
+				assert codec == 'gzip', "defer_compression only works with gzip compression"
+				assert not block_rows, "defer_compression doesn't work with block_rows"
+				mode = 'w0' # gzip, but not compressed
 			os.mkdir(name)
 			obj = object.__new__(cls)
 			obj._running = running
@@ -735,6 +1434,15 @@ class DatasetWriter(object):
 			obj.columns = {}
 			obj.meta_only = meta_only
 			obj._for_single_slice = for_single_slice
+			obj.compression = uni(compression)
+			obj._codec = codec
+			obj._mode = mode
+			obj.block_rows = block_rows
+			obj.bloom = set(uni(n) for n in bloom)
+			obj.spill_rows = spill_rows
+			obj.defer_compression = defer_compression
+			obj.narrow_numbers = narrow_numbers
+			obj.column_groups = [[uni(n) for n in names] for names in column_groups]
 			obj._clean_names = {}
 			if parent:
 				obj._pcolumns = Dataset(parent).columns
@@ -742,6 +1450,7 @@ class DatasetWriter(object):
 			else:
 				obj._pcolumns = {}
 				obj._seen_n = set()
+			obj._group_names = [_clean_name('group%d' % (ix,), obj._seen_n) for ix in range(len(column_groups))]
 			obj._started = False
 			obj._lens = {}
 			obj._minmax = {}
@@ -761,7 +1470,12 @@ class DatasetWriter(object):
 		coltype = uni(coltype)
 		assert colname not in self.columns, colname
 		assert colname
-		typed_writer(coltype) # gives error for unknown types
+		wt = typed_writer(coltype) # gives error for unknown types
+		if colname in self.bloom:
+			assert hasattr(wt, 'hash'), "Can't have a Bloom filter on %s columns (the values have no hash)" % (coltype,)
+		if sidecar_type(coltype):
+			assert not self.block_rows, "block_rows (and column_groups) doesn't work with %s columns" % (coltype,)
+			assert self._codec in ('gzip', 'raw',), "%s columns only work with gzip or raw compression" % (coltype,)
 		self.columns[colname] = (coltype, default)
 		self._order.append(colname)
 		if colname in self._pcolumns:
@@ -788,24 +1502,60 @@ class DatasetWriter(object):
 			sliceno = self.sliceno
 		return '%s/%d.%s' % (self.name, sliceno, self._clean_names[colname],)
 
+	def _index_filename(self, colname, sliceno):
+		return self.column_filename(colname, sliceno) + '.idx'
+
+	def _bloom_filename(self, colname, sliceno):
+		return self.column_filename(colname, sliceno) + '.bloom'
+
+	def _group_filename(self, ix, sliceno):
+		return '%s/%d.%s' % (self.name, sliceno, self._group_names[ix],)
+
+	def _groups(self):
+		"""{colname: group name} for the grouped columns"""
+		return {n: self._group_names[ix] for ix, names in enumerate(self.column_groups) for n in names}
+
+	def _dict_filename(self, colname, sliceno):
+		return self.column_filename(colname, sliceno) + '.dict'
+
 	def _mkwriters(self, sliceno, filtered=True):
 		assert self.columns, "No columns in dataset"
 		if self.hashlabel:
 			assert self.hashlabel in self.columns, "Hashed column (%s) missing" % (self.hashlabel,)
+		assert self.bloom <= set(self.columns), "Bloom filter for missing column(s) %r" % (self.bloom - set(self.columns),)
+		grouped = [n for names in self.column_groups for n in names]
+		assert len(grouped) == len(set(grouped)), "Columns in more than one group"
+		assert set(grouped) <= set(self.columns), "Grouped missing column(s) %r" % (set(grouped) - set(self.columns),)
 		self._started = 2 - filtered
 		if self.meta_only:
 			return
+		groups = {}
+		for ix, names in enumerate(self.column_groups):
+			group = GzWriteGroup(self._group_filename(ix, sliceno), self.block_rows, self._mode)
+			for n in names:
+				groups[n] = group
 		writers = {}
 		for colname, (coltype, default) in self.columns.items():
 			wt = typed_writer(coltype)
 			kw = {} if default is _nodefault else {'default': default}
+			if self._mode:
+				kw['mode'] = self._mode
 			fn = self.column_filename(colname, sliceno)
 			if filtered and colname == self.hashlabel:
 				from g import SLICES
-				w = wt(fn, hashfilter=(sliceno, SLICES), **kw)
-				self.hashcheck = w.hashcheck
+				kw['hashfilter'] = (sliceno, SLICES)
+			if colname in groups:
+				w = groups[colname].writer(self._clean_names[colname], wt, **kw)
+			elif self.block_rows:
+				w = GzWriteBlocked(wt, fn, self.block_rows, **kw)
 			else:
 				w = wt(fn, **kw)
+			if self._codec in ('bz2', 'lzma',):
+				w = GzWriteRecompress(w, fn, self._codec)
+			if colname in self.bloom:
+				w = GzWriteBloom(w, kw.get('default'))
+			if 'hashfilter' in kw:
+				self.hashcheck = w.hashcheck
 			writers[colname] = w
 		return writers
 
@@ -849,6 +1599,110 @@ class DatasetWriter(object):
 		eval(compile('\n'.join(f_list), '<DatasetWriter generated write_list>', 'exec'), w_d)
 		self.write_list = w_d['write_list']
 
+	def write_arrays(self, arrays):
+		"""Write {column: values} (all the same length) to this slice."""
+		assert set(arrays) == set(self._order), "Specify all columns (and only those)"
+		self.write_columns(*[arrays[n] for n in self._order])
+
+	def write_columns(self, *seqs):
+		"""Write one sequence (or numpy array) of values per column (in
+		the same order as for dw.write) to this slice. Each column is
+		written in one go, and with a hashlabel only the values that
+		belong in this slice are kept."""
+		from collections import deque
+		assert len(seqs) == len(self._order), "Need values for all %d columns" % (len(self._order),)
+		# numpy arrays give normal python values with tolist
+		seqs = [v.tolist() if hasattr(v, 'tolist') else v for v in seqs]
+		assert len(set(len(v) for v in seqs)) == 1, "All columns must have the same length"
+		hl = self.hashlabel
+		if hl:
+			# The hashlabel writer filters, and says which values it kept.
+			keep = list(imap(self.writers[hl].write, seqs[self._order.index(hl)]))
+		for n, v in zip(self._order, seqs):
+			if n == hl:
+				continue
+			if hl:
+				v = compress(v, keep)
+			deque(imap(self.writers[n].write, v), maxlen=0)
+
+	def split_write_arrays(self, arrays):
+		"""Write {column: values} (all the same length), split over the slices."""
+		assert set(arrays) == set(self._order), "Specify all columns (and only those)"
+		self.split_write_columns(*[arrays[n] for n in self._order])
+
+	def split_write_columns(self, *seqs):
+		"""Like write_columns, but the rows are split over the slices like
+		the split writers do (by hashlabel or round robin)."""
+		import g
+		from collections import deque
+		from operator import itemgetter
+		from gzwrite import hash_array, slice_groups
+		if g.running == 'analysis':
+			assert self._for_single_slice == g.sliceno, "Only use dataset in designated slice"
+		assert self._started != 1, "Don't use both a split writer and set_slice"
+		assert len(seqs) == len(self._order), "Need values for all %d columns" % (len(self._order),)
+		seqs = [v.tolist() if hasattr(v, 'tolist') else list(v) for v in seqs]
+		lens = set(len(v) for v in seqs)
+		assert len(lens) == 1, "All columns must have the same length"
+		count = lens.pop()
+		if not count:
+			return
+		from g import SLICES as slices
+		hl = self.hashlabel
+		if hl:
+			hashes = hash_array(seqs[self._order.index(hl)], self._split_hash())
+			groups = slice_groups([h % slices for h in hashes], slices)
+			def rows(seq, ix):
+				if not ix:
+					return ()
+				if len(ix) == 1:
+					return (seq[ix[0]],)
+				return itemgetter(*ix)(seq)
+		else:
+			# Continue the same round robin as the other split writers.
+			start = next(self._split_cycle)
+			deque(islice(self._split_cycle, count - 1), maxlen=0)
+			groups = [(sliceno - start) % slices for sliceno in range(slices)]
+			def rows(seq, ix):
+				return seq[ix::slices]
+		if self.spill_rows:
+			for spiller, ix in zip(self._spillers, groups):
+				for buf, seq in zip(spiller.buffers, seqs):
+					buf.extend(rows(seq, ix))
+				spiller.check()
+		else:
+			writers = self._allwriters
+			for sliceno, ix in enumerate(groups):
+				for n, seq in zip(self._order, seqs):
+					deque(imap(writers[sliceno][n].write, rows(seq, ix)), maxlen=0)
+
+	def _split_hash(self):
+		if self.spill_rows:
+			# The real writers don't exist yet, this one is only for .hash.
+			coltype, default = self.columns[self.hashlabel]
+			kw = {} if default is _nodefault else {'default': default}
+			return typed_writer(coltype)(os.devnull, **kw).hash
+		return self._allwriters[0][self.hashlabel].hash
+
+	@property
+	def _split_cycle(self):
+		if not self._split_cycle_:
+			from itertools import cycle
+			from g import SLICES
+			self._split_cycle_ = cycle(range(SLICES))
+		return self._split_cycle_
+
+	@property
+	def _spillers(self):
+		if self._spillers_:
+			return self._spillers_
+		from g import SLICES
+		assert self.columns, "No columns in dataset"
+		self._started = 2
+		limit = max(1, self.spill_rows // SLICES)
+		self._spillers_ = [_SpillSlice('%s/spill.%d' % (self.name, sliceno), len(self._order), limit) for sliceno in range(SLICES)]
+		return self._spillers_
+
 	@property
 	def _allwriters(self):
 		if self._allwriters_:
@@ -878,20 +1732,22 @@ class DatasetWriter(object):
 			return self._order.index(t[0])
 		def d2l(d):
 			return [w.write for _, w in sorted(d.items(), key=key)]
-		w_d['writers'] = [d2l(d) for d in self._allwriters]
+		if self.spill_rows:
+			w_d['writers'] = self._spillers
+		else:
+			w_d['writers'] = [d2l(d) for d in self._allwriters]
 		f_____ = ['def split(' + ', '.join(names) + '):']
 		f_list = ['def split_list(v):']
 		f_dict = ['def split_dict(d):']
 		from g import SLICES
 		hl = self.hashlabel
 		if hl:
-			w_d['h'] = self._allwriters[0][hl].hash
+			w_d['h'] = self._split_hash()
 			f_____.append('w_l = writers[h(%s) %% %d]' % (hl, SLICES,))
 			f_list.append('w_l = writers[h(v[%d]) %% %d]' % (self._order.index(hl), SLICES,))
 			f_dict.append('w_l = writers[h(d[%r]) %% %d]' % (hl, SLICES,))
 		else:
-			from itertools import cycle
-			w_d['c'] = cycle(range(SLICES))
+			w_d['c'] = self._split_cycle
 			f_____.append('w_l = writers[next(c)]')
 			f_list.append('w_l = writers[next(c)]')
 			f_dict.append('w_l = writers[next(c)]')
@@ -899,6 +1755,9 @@ class DatasetWriter(object):
 			f_____.append('w_l[%d](%s)' % (ix, names[ix],))
 			f_list.append('w_l[%d](v[%d])' % (ix, ix,))
 			f_dict.append('w_l[%d](d[%r])' % (ix, self._order[ix],))
+		if self.spill_rows:
+			for f in (f_____, f_list, f_dict,):
+				f.append('if len(w_l.rows) >= w_l.limit: w_l.spill()')
 		eval(compile('\n '.join(f_____), '<DatasetWriter generated split_write>'     , 'exec'), w_d)
 		eval(compile('\n '.join(f_list), '<DatasetWriter generated split_write_list>', 'exec'), w_d)
 		eval(compile('\n '.join(f_dict), '<DatasetWriter generated split_write_dict>', 'exec'), w_d)
@@ -908,19 +1767,44 @@ class DatasetWriter(object):
 		return w_d
 
 	def _close(self, sliceno, writers):
-		lens = {}
+		lens = {k: w.count for k, w in writers.items()}
+		len_set = set(lens.values())
+		assert len(len_set) == 1, "Not all columns have the same linecount in slice %d: %r" % (sliceno, lens)
 		minmax = {}
+		grouped = self._groups()
+		groups = set(w.group for k, w in writers.items() if k in grouped)
+		for group in groups:
+			group.flush() # the last block, so min/max are complete
 		for k, w in writers.items():
-			lens[k] = w.count
 			minmax[k] = (w.min, w.max,)
 			w.close()
-		len_set = set(lens.values())
-		assert len(len_set) == 1, "Not all columns have the same linecount in slice %d: %r" % (sliceno, lens)
+			if self.block_rows and k not in grouped:
+				blob.save(w.index, self._index_filename(k, sliceno), temp=False)
+			if k in self.bloom:
+				blob.save(w.bloom, self._bloom_filename(k, sliceno), temp=False)
+			if dict_type(self.columns[k][0]):
+				blob.save(w.dictionary, self._dict_filename(k, sliceno), temp=False)
+		for group in groups:
+			# (complete now that all the column writers are closed.)
+			blob.save(group.index, group.fn + '.idx', temp=False)
 		self._lens[sliceno] = len_set.pop()
 		self._minmax[sliceno] = minmax
 
 	def close(self):
 		if self._started == 2:
+			if self._split_closed:
+				return
+			self._split_closed = True
+			if self.spill_rows:
+				from collections import deque
+				for sliceno, spiller in enumerate(self._spillers):
+					writers = self._mkwriters(sliceno, False)
+					w_l = [writers[n].write for n in self._order]
+					for batch in spiller.batches():
+						for w, values in zip(w_l, batch):
+							deque(imap(w, values), maxlen=0)
+					self._close(sliceno, writers)
+				return
 			for sliceno, writers in enumerate(self._allwriters):
 				self._close(sliceno, writers)
 		else:
@@ -941,6 +1825,44 @@ class DatasetWriter(object):
 		assert self.meta_only, "Don't try to set minmax for writers that actually write"
 		self._minmax[sliceno] = minmax
 
+	def _narrow_numbers(self):
+		# {colname: "int64" or "float64"} for the number columns that
+		# have been rewritten as that type.
+		from g import SLICES
+		from collections import deque
+		from sourcedata import type2iter
+		if self.block_rows or self._codec not in ('gzip', 'raw',):
+			return {}
+		res = {}
+		for colname, (coltype, _) in sorted(self.columns.items()):
+			if _unparsed(coltype) != 'number' or colname == self.hashlabel or colname in self.bloom:
+				continue
+			fns = [self.column_filename(colname, sliceno) for sliceno in range(SLICES)]
+			kinds = set()
+			for fn in fns:
+				with type2iter['number'](fn) as it:
+					kinds.update(imap(type, it))
+			kinds.discard(type(None))
+			if kinds == {int}:
+				minmax = [self._minmax.get(sliceno, {}).get(colname) for sliceno in range(SLICES)]
+				if None in minmax:
+					continue # no set_minmax for this column, so the range is unknown.
+				if not all(-0x7fffffffffffffff <= v <= 0x7fffffffffffffff for mm in minmax for v in mm if v is not None):
+					continue # (the smallest int64 is None)
+				res[colname] = 'int64'
+			elif kinds == {float}:
+				res[colname] = 'float64'
+			else:
+				continue # mixed (or empty), stays number.
+			wt = typed_writer(res[colname])
+			kw = {'mode': self._mode} if self._mode else {}
+			for fn in fns:
+				tmp_fn = fn + '.narrow'
+				with type2iter['number'](fn) as it, wt(tmp_fn, **kw) as w:
+					deque(imap(w.write, it), maxlen=0)
+				os.rename(tmp_fn, fn)
+		return res
+
 	def finish(self):
 		"""Normally you don't need to call this, but if you want to
 		pass yourself as a dataset to a subjob you need to call
@@ -949,8 +1871,11 @@ class DatasetWriter(object):
 		assert running == self._running or running == 'synthesis', "Finish where you started or in synthesis"
 		self.close()
 		assert len(self._lens) == SLICES, "Not all slices written, missing %r" % (set(range(SLICES)) - set(self._lens),)
+		columns = {k: _unparsed(v[0]) for k, v in self.columns.items()}
+		if self.narrow_numbers:
+			columns.update(self._narrow_numbers())
 		args = dict(
-			columns={k: v[0].split(':')[-1] for k, v in self.columns.items()},
+			columns=columns,
 			filenames=self._clean_names,
 			lines=self._lens,
 			minmax=self._minmax,
@@ -959,15 +1884,126 @@ class DatasetWriter(object):
 			caption=self.caption,
 			previous=self.previous,
 			name=self.name,
+			compression=self.compression,
+			indexed=bool(self.block_rows),
+			bloom=self.bloom,
+			deferred=self.defer_compression,
+			groups=self._groups(),
 		)
 		if self.parent:
 			res = Dataset(self.parent)
 			res.append(hashlabel_override=self.hashlabel_override, **args)
 		else:
 			res = Dataset.new(**args)
+		if self.defer_compression:
+			open(DEFERRED_MARKER, 'a').close()
 		del _datasetwriters[self.name]
 		return res
 
+class _ReadAhead(object):
+	"""Reads it in a helper thread, chunk_rows values at a time, with at
+	most depth chunks waiting. Iterate over it once, and close it if you
+	don't read to the end."""
+	def __init__(self, it, chunk_rows=4096, depth=4):
+		from threading import Thread
+		from compat import Queue
+		self._q = Queue(depth)
+		self._stop = False
+		t = Thread(target=self._run, args=(it, chunk_rows,), name='read-ahead')
+		t.daemon = True
+		t.start()
+
+	def _run(self, it, chunk_rows):
+		try:
+			while not self._stop:
+				chunk = list(islice(it, chunk_rows))
+				self._q.put((chunk, None,))
+				if not chunk:
+					return
+		except Exception as e:
+			self._q.put((None, e,))
+
+	def _chunks(self):
+		try:
+			while True:
+				chunk, e = self._q.get()
+				if e is not None:
+					raise e
+				if not chunk:
+					return
+				yield chunk
+		finally:
+			self.close()
+
+	def __iter__(self):
+		from itertools import chain
+		return chain.from_iterable(self._chunks())
+
+	def close(self):
+		self._stop = True
+		# Make room, so the thread can see _stop. Only we get from the queue.
+		while self._q.qsize():
+			self._q.get()
+
+class _SpillSlice(list):
+	"""The column buffer appends for one slice of a spilling split writer.
+	Full buffers are appended to fn, as a pickled list of column lists."""
+	def __init__(self, fn, columns, limit):
+		self.fn = fn
+		self.limit = limit
+		self.buffers = [[] for _ in range(columns)]
+		self.rows = self.buffers[0]
+		list.__init__(self, [buf.append for buf in self.buffers])
+
+	def check(self):
+		if len(self.rows) >= self.limit:
+			self.spill()
+
+	def spill(self):
+		from compat import pickle
+		if self.rows:
+			with open(self.fn, 'ab') as fh:
+				pickle.dump(self.buffers, fh, 2)
+			for buf in self.buffers:
+				del buf[:]
+
+	def batches(self):
+		"""All the buffered values, as lists of column lists. Removes fn."""
+		from compat import pickle
+		if os.path.exists(self.fn):
+			with open(self.fn, 'rb') as fh:
+				while True:
+					try:
+						yield pickle.load(fh)
+					except EOFError:
+						break
+			os.unlink(self.fn)
+		if self.rows:
+			yield self.buffers
+
+def _column_batches(its, batch_size, want_tuple, batch_columns):
+	# Each column is read a batch at a time, rows are only built if wanted.
+	while True:
+		cols = [list(islice(it, batch_size)) for it in its]
+		if not cols[0]:
+			return
+		if not want_tuple:
+			yield cols[0]
+		elif batch_columns:
+			yield cols
+		else:
+			yield list(izip(*cols))
+
+def _row_batches(it, batch_size, want_tuple, batch_columns):
+	while True:
+		rows = list(islice(it, batch_size))
+		if not rows:
+			return
+		if want_tuple and batch_columns:
+			yield [list(col) for col in izip(*rows)]
+		else:
+			yield rows
+
 def range_check_function(bottom, top):
 	"""Returns a function that checks if bottom <= arg < top, allowing bottom and/or top to be None"""
 	import operator
@@ -984,6 +2020,99 @@ def range_check_function(bottom, top):
 			return v >= bottom and v < top
 		return range_f
 
+def predicate_expression(pred, value, consts):
+	"""Python expression for the declarative filter pred on value (also an
+	expression). Constants are added to consts as {name: value}."""
+	def const(v):
+		name = 'p%d' % (len(consts),)
+		consts[name] = v
+		return name
+	op = pred[0]
+	if op == 'eq':
+		return '%s == %s' % (value, const(pred[1]),)
+	elif op == 'in':
+		return '%s in %s' % (value, const(frozenset(pred[1])),)
+	elif op == 'between':
+		bottom, top = pred[1:]
+		res = ['%s is not None' % (value,)]
+		if bottom is not None:
+			res.append('%s >= %s' % (value, const(bottom),))
+		if top is not None:
+			res.append('%s < %s' % (value, const(top),))
+		return '(%s)' % (' and '.join(res),)
+	elif op == 'isnull':
+		return '%s is None' % (value,)
+	elif op in ('and', 'or',):
+		assert len(pred) > 1, "Nothing to %s in %r" % (op, pred,)
+		return '(%s)' % ((' %s ' % (op,)).join(predicate_expression(p, value, consts) for p in pred[1:]),)
+	elif op == 'not':
+		return '(not %s)' % (predicate_expression(pred[1], value, consts),)
+	raise Exception('Unknown filter %r' % (pred,))
+
+def predicate_may_match(pred, bottom, top):
+	"""False if no value bottom <= v <= top can match pred. (None values
+	are not in min/max, so filters that can match None always may.)"""
+	if bottom is None or top is None:
+		return True
+	op = pred[0]
+	try:
+		if op == 'eq':
+			return pred[1] is None or bottom <= pred[1] <= top
+		elif op == 'in':
+			return any(v is None or bottom <= v <= top for v in pred[1])
+		elif op == 'between':
+			return not (pred[2] is not None and bottom >= pred[2]) and not (pred[1] is not None and top < pred[1])
+		elif op == 'and':
+			return all(predicate_may_match(p, bottom, top) for p in pred[1:])
+		elif op == 'or':
+			return any(predicate_may_match(p, bottom, top) for p in pred[1:])
+	except TypeError:
+		pass # not comparable with this column
+	return True
+
+def compress_deferred(jobdir):
+	"""Compress the columns written with defer_compression in the datasets
+	in jobdir (a finished job). Each file (including sidecars like the
+	.offsets of heap columns) is recompressed to a temp file that is
+	renamed over the original, which is safe for readers (both are gzip),
+	and then the datasets are saved without the deferred list. Doing a
+	file again is harmless, so this can be rerun if interrupted.
+	The daemon runs this in the background after jobs that need it
+	(the ones with a DEFERRED_MARKER file), and again at startup for
+	any that were left with a marker."""
+	from gzwrite import gzip_in_place, column_files
+	from compat import pickle
+	jobid = os.path.basename(os.path.normpath(jobdir))
+	for name in sorted(os.listdir(jobdir)):
+		pickle_fn = os.path.join(jobdir, name, 'dataset.pickle')
+		if not os.path.exists(pickle_fn):
+			continue
+		data = DotDict(blob.load(pickle_fn))
+		pending = data.get('deferred')
+		if not pending:
+			continue
+		for colname, compression in sorted(pending.items()):
+			dc = data.columns[colname]
+			jid, path = dc.location.split('/', 1)
+			if jid != jobid:
+				continue # from a parent dataset, that job does its own.
+			level = compression.partition(':')[2]
+			for sliceno in builtins.range(len(data.lines)):
+				for fn in column_files(dc.type, os.path.join(jobdir, path % (sliceno,))):
+					gzip_in_place(fn, int(level) if level else None)
+		# Inherited entries go too, so no dataset is left with a deferred list.
+		del data.deferred
+		tmp_fn = '%s.%dtmp' % (pickle_fn, os.getpid(),)
+		with open(tmp_fn, 'wb') as fh:
+			pickle.dump(data, fh, 2)
+		os.rename(tmp_fn, pickle_fn)
+	marker = os.path.join(jobdir, DEFERRED_MARKER)
+	if os.path.exists(marker):
+		os.unlink(marker)
+
+# Jobs with datasets waiting for compress_deferred have this file.
+DEFERRED_MARKER = 'deferred_compression'
+
 class SkipJob(Exception):
 	"""Raise this in pre_callback to skip iterating the coming job
 	(or the remaining slices of it)"""
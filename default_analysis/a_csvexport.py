@@ -66,7 +66,8 @@ def csvexport(sliceno, filename, labelsonfirstline):
 	iters = []
 	for label in options.labels:
 		it = d.iterate_list(sliceno, label, datasets.source)
-		t = d.columns[label].type
+		# ascii:dict, unicode:heap and so on give the same values as the plain type
+		t = d.columns[label].type.split(':')[0]
 		if t == 'unicode':
 			it = imap(lambda s: s.encode('utf-8'), it)
 		elif t not in ('ascii', 'bytes'):
@@ -23,21 +23,56 @@ CSV file to dataset.
 
 Read a CSV file, with any single character separator, with or without quotes.
 Labels from first line or specified in options.
+
+With single_read files are split in byte ranges (aligned to line starts),
+one per slice, so the file is only read once in total. For gzip files this
+uses an index of access points (every few MB) built in a first pass. With
+gz_index_cache the index is also kept next to the file (as filename.gzidx)
+and reused for as long as the size and mtime stay the same. Without a
+hashlabel each slice keeps the lines in its range (so lines are not
+distributed round robin in this mode). With a hashlabel lines belonging
+to other slices are passed on through spill files, which synthesis
+imports into their slices (in parallel) once all slices are done.
+
+filename can be a glob pattern, and filenames can list more files (or
+patterns). With several files each file is read whole by one slice (with
+spill files as above if there is a hashlabel). They become one dataset, or
+with as_chain one dataset per file, chained in filename order. With
+labelsonfirstline all files must have the same first line.
+
+column2type (and defaults) work like in dataset_type, but the conversion
+happens while importing so the columns are written typed directly. Only
+types with a C converter (and bytes/bytesstrip) are supported, use
+dataset_type for the others. A value that fails to convert (and has no
+default) makes the line bad, so it is skipped (with allow_bad).
 '''
 
 
 import os
 import cffi
+import struct
+import heapq
+from glob import glob
+from bisect import bisect_right
 
 import report
 from extras import OptionString
+from compat import pickle, unicode
 import blob
 import gzutil
 from dataset import DatasetWriter
+from extras import OptionEnum, OptionDefault
+import dataset_typing
+
+depend_extra = (dataset_typing,)
+
+TYPENAME = OptionEnum(dataset_typing.convfuncs.keys())
 
 
 options = {
-	'filename'                  : OptionString,
+	'filename'                  : OptionString, # can be a glob pattern
+	'filenames'                 : [],    # more files (or glob patterns) to import in the same job
+	'as_chain'                  : False, # one dataset per file (chained) instead of one dataset
 	'separator'                 : ',',
 	'labelsonfirstline'         : True,
 	'labels'                    : [], # Mandatory if not labelsonfirstline, always sets labels if set.
@@ -46,6 +81,10 @@ options = {
 	'rename'                    : {},    # Labels to replace (if they are in the file) (happens first)
 	'discard'                   : set(), # Labels to not include (if they are in the file)
 	'allow_bad'                 : False, # Still succeed if some lines have too few/many fields.
+	'single_read'               : False, # Split file in byte ranges instead of every slice reading everything.
+	'gz_index_cache'            : False, # Keep the single_read gzip index next to the file for later jobs.
+	'column2type'               : OptionDefault({'COLNAME': TYPENAME}, {}), # Convert while importing (after rename), see above.
+	'defaults'                  : {}, # {'COLNAME': value}, unspecified -> line is bad on unconvertible
 }
 
 datasets = ('previous', )
@@ -53,25 +92,167 @@ datasets = ('previous', )
 
 ffi = cffi.FFI()
 ffi.cdef('''
-int import_slice(const char *fn, const int slices, const int sliceno, const int skip_line, const int field_count, const char *out_fns[], const char separator, int hash_idx, uint64_t *res_num, const int quote_support);
+int import_slice(const char *fn, const int slices, const int sliceno, const int skip_line, const int field_count, const char *out_fns[], const char separator, int hash_idx, uint64_t *res_num, const int quote_support, const int64_t start, const int64_t stop, const char *spill_fns[], const int64_t idx_in, const int idx_bits, const int64_t idx_out, const unsigned char *idx_window, const int col_types[], const char *col_fmts[], const char *col_defaults[], const int col_default_none[], char *minmax_buf);
+void setup_minmax(const int field_count, const int col_types[], char *minmax_buf);
+int build_gz_index(const char *fn, const int64_t span, const char *out_fn, int64_t *res_size);
 ''')
+
+# Converters (and minmax) for the column2type types that have C code,
+# used through the typeinfo table (indexed by col_types in import_slice).
+typed_template = r'''
+static char *conv_%(shortname)s(const char *line, char *ptr, const char *fmt)
+{
+%(convert)s
+	return ptr;
+}
+
+static void minmax_%(shortname)s(const char *ptr, char *buf_col_min, char *buf_col_max)
+{
+	%(minmax_code)s;
+}
+
+static void minmax_setup_%(shortname)s(char *buf_col_min, char *buf_col_max)
+{
+	%(minmax_setup)s;
+}
+'''
+
+typed_names = []
+typed_funcs = [dataset_typing.minmax_data, dataset_typing.noneval_data]
+typed_table = []
+for name, ct in sorted(dataset_typing.convfuncs.items()):
+	if not ct.conv_code_str:
+		continue
+	shortname = name.split(':', 1)[0]
+	destname = dataset_typing.typerename.get(shortname, shortname)
+	mm = dataset_typing.minmaxfuncs[destname]
+	typed_funcs.append(typed_template % dict(shortname=shortname, convert=ct.conv_code_str, minmax_code=mm.code, minmax_setup=mm.setup))
+	noneval = '0' if destname.startswith('bits') else '&noneval_' + destname
+	typed_table.append('\t{conv_%s, minmax_%s, minmax_setup_%s, %d, %s},\n' % (shortname, shortname, shortname, ct.size, noneval,))
+	typed_names.append(shortname)
+typed_funcs.append(r'''
+#define TYPED_BYTES      -1
+#define TYPED_BYTESSTRIP -2
+
+typedef struct {
+	char *(*conv)(const char *line, char *ptr, const char *fmt);
+	void (*minmax)(const char *ptr, char *buf_col_min, char *buf_col_max);
+	void (*minmax_setup)(char *buf_col_min, char *buf_col_max);
+	int size;
+	const void *noneval;
+} typeinfo_t;
+
+static const typeinfo_t typeinfo[] = {
+''' + ''.join(typed_table) + r'''};
+
+// Each column has 16 bytes of minmax_buf, min in the first 8 and max in the rest.
+void setup_minmax(const int field_count, const int col_types[], char *minmax_buf)
+{
+	for (int i = 0; i < field_count; i++) {
+		if (col_types[i] >= 0) {
+			typeinfo[col_types[i]].minmax_setup(minmax_buf + i * 16, minmax_buf + i * 16 + 8);
+		}
+	}
+}
+''')
+TYPED_BYTES = -1
+TYPED_BYTESSTRIP = -2
+
 backend = ffi.verify(r'''
 #include <zlib.h>
 #include <stdlib.h>
+#include <time.h>
+#include <strings.h>
+#include <errno.h>
+#include <math.h>
+#include <float.h>
 
 #define err1(v) if (v) goto err
 #define Z (128 * 1024)
+#define WINSIZE 32768
 
 typedef struct {
 	gzFile fh;
+	FILE *raw; // instead of fh when starting from an index point
+	z_stream zs;
+	int raw_deflate;
+	unsigned char *in;
 	int len;
 	int pos;
+	int64_t consumed;
 	char buf[Z + 1];
 } g;
 
+static int fill_in(g *g)
+{
+	g->zs.avail_in = fread(g->in, 1, Z, g->raw);
+	g->zs.next_in = g->in;
+	return !g->zs.avail_in;
+}
+
+// Like gzread, but from the inflate stream set up in open_at_point.
+// When the deflate stream we started in ends we skip its trailer and
+// let zlib handle any following gzip members.
+static int zread(g *g, char *buf, const int len)
+{
+	g->zs.next_out = (unsigned char *)buf;
+	g->zs.avail_out = len;
+	while (g->zs.avail_out) {
+		if (!g->zs.avail_in && fill_in(g)) break;
+		const int ret = inflate(&g->zs, Z_NO_FLUSH);
+		if (ret == Z_STREAM_END) {
+			if (g->raw_deflate) {
+				for (int skip = 8; skip;) {
+					if (!g->zs.avail_in && fill_in(g)) break;
+					const int l = skip < g->zs.avail_in ? skip : g->zs.avail_in;
+					g->zs.next_in += l;
+					g->zs.avail_in -= l;
+					skip -= l;
+				}
+				g->raw_deflate = 0;
+				if (inflateReset2(&g->zs, 47) != Z_OK) return -1;
+			} else {
+				if (inflateReset(&g->zs) != Z_OK) return -1;
+			}
+		} else if (ret != Z_OK) {
+			break; // garbage after the last member, like gzread we stop there
+		}
+	}
+	return len - g->zs.avail_out;
+}
+
+static int open_at_point(g *g, const char *fn, const int64_t in, const int bits, const unsigned char *window)
+{
+	g->raw = fopen(fn, "rb");
+	if (!g->raw) return 1;
+	g->in = malloc(Z);
+	if (!g->in) return 1;
+	memset(&g->zs, 0, sizeof(g->zs));
+	if (inflateInit2(&g->zs, -15) != Z_OK) return 1;
+	g->raw_deflate = 1;
+	if (fseeko(g->raw, in - (bits ? 1 : 0), SEEK_SET)) return 1;
+	if (bits) {
+		const int c = fgetc(g->raw);
+		if (c == EOF) return 1;
+		if (inflatePrime(&g->zs, bits, c >> (8 - bits)) != Z_OK) return 1;
+	}
+	if (inflateSetDictionary(&g->zs, window, WINSIZE) != Z_OK) return 1;
+	return 0;
+}
+
+static void close_g(g *g)
+{
+	if (g->fh) gzclose(g->fh);
+	if (g->raw) {
+		inflateEnd(&g->zs);
+		fclose(g->raw);
+	}
+	free(g->in);
+}
+
 static int read_chunk(g *g, int offset)
 {
-	const int len = gzread(g->fh, g->buf + offset, Z - offset);
+	const int len = g->raw ? zread(g, g->buf + offset, Z - offset) : gzread(g->fh, g->buf + offset, Z - offset);
 	if (len <= 0) return 1;
 	g->len = offset + len;
 	g->buf[g->len] = 0;
@@ -92,6 +273,7 @@ static char *read_line(g *g)
 		if (read_chunk(g, linelen)) { // if eof
 			g->pos = g->len;
 			g->buf[linelen] = 0;
+			g->consumed += linelen;
 			return linelen ? g->buf : 0;
 		}
 		ptr = g->buf;
@@ -100,11 +282,12 @@ static char *read_line(g *g)
 	}
 	const int linelen = end - ptr;
 	g->pos += linelen + 1;
+	g->consumed += linelen + 1;
 	ptr[linelen] = 0;
 	if (linelen && ptr[linelen - 1] == '\r') ptr[linelen - 1] = 0;
 	return ptr;
 }
-
+''' + ''.join(typed_funcs) + r'''
 #define HANDLE_UNQUOTED \
 	do { \
 		char *end = strchr(line, separator); \
@@ -121,19 +304,78 @@ static char *read_line(g *g)
 		line = end + 1; \
 	} while (0)
 
-int import_slice(const char *fn, const int slices, const int sliceno, const int skip_line, const int field_count, const char *out_fns[], const char separator, int hash_idx, uint64_t *res_num, const int quote_support)
+int import_slice(const char *fn, const int slices, const int sliceno, const int skip_line, const int field_count, const char *out_fns[], const char separator, int hash_idx, uint64_t *res_num, const int quote_support, const int64_t start, const int64_t stop, const char *spill_fns[], const int64_t idx_in, const int idx_bits, const int64_t idx_out, const unsigned char *idx_window, const int col_types[], const char *col_fmts[], const char *col_defaults[], const int col_default_none[], char *minmax_buf)
 {
 	int res = 1;
 	g g;
-	g.fh = gzopen(fn, "rb");
-	if (!g.fh) return 1;
+	g.fh = 0;
+	g.raw = 0;
+	g.in = 0;
 	g.pos = g.len = 0;
+	g.consumed = 0;
 	char *line;
-	if (skip_line) read_line(&g);
+	if (idx_window) {
+		if (open_at_point(&g, fn, idx_in, idx_bits, idx_window)) {
+			close_g(&g);
+			return 1;
+		}
+		// get from the index point to just before start
+		for (int64_t left = start - 1 - idx_out; left;) {
+			const int len = zread(&g, g.buf, left < Z ? left : Z);
+			if (len <= 0) {
+				close_g(&g);
+				return 1;
+			}
+			left -= len;
+		}
+	} else {
+		g.fh = gzopen(fn, "rb");
+		if (!g.fh) return 1;
+	}
+	// With a byte range (stop >= 0) we read the lines starting in [start, stop).
+	// The line that started before start belongs to the previous range.
+	if (start) {
+		if (!idx_window && gzseek(g.fh, start - 1, SEEK_SET) != start - 1) {
+			close_g(&g);
+			return 1;
+		}
+		g.consumed = start - 1;
+		read_line(&g);
+	} else if (skip_line) {
+		read_line(&g);
+	}
 	gzFile outfh[field_count];
 	for (int i = 0; i < field_count; i++) {
 		outfh[i] = 0;
 	}
+	// With col_types values are converted to typed values in convbuf,
+	// with the converted col_defaults in defbuf.
+	char convbuf[field_count][8];
+	char defbuf[field_count][8];
+	const char *converted[field_count];
+	if (col_types) {
+		for (int i = 0; i < field_count; i++) {
+			const int t = col_types[i];
+			if (t < 0) continue;
+			if (col_default_none[i]) {
+				if (!typeinfo[t].noneval) {
+					close_g(&g);
+					return 1;
+				}
+				memcpy(defbuf[i], typeinfo[t].noneval, typeinfo[t].size);
+			} else if (col_defaults[i]) {
+				if (!typeinfo[t].conv(col_defaults[i], defbuf[i], col_fmts[i])) {
+					close_g(&g);
+					return 1;
+				}
+			}
+		}
+	}
+	FILE *spillfh[slices];
+	for (int i = 0; i < slices; i++) {
+		spillfh[i] = 0;
+	}
+	char *copy = 0;
 	PyGILState_STATE gstate = PyGILState_Ensure();
 	uint64_t (*hash)(const void *ptr, const uint64_t len) = PyCapsule_Import("gzutil._C_hash", 0);
 	err1(!hash);
@@ -143,12 +385,30 @@ int import_slice(const char *fn, const int slices, const int sliceno, const int
 			err1(!outfh[i]);
 		}
 	}
+	if (spill_fns) {
+		for (int i = 0; i < slices; i++) {
+			if (spill_fns[i]) {
+				spillfh[i] = fopen(spill_fns[i], "ab");
+				err1(!spillfh[i]);
+			}
+		}
+		copy = malloc(Z + 1);
+		err1(!copy);
+	}
 	long lineno = -1;
-	while ((line = read_line(&g))) {
+	while (stop < 0 || g.consumed < stop) {
+		line = read_line(&g);
+		if (!line) break;
 		lineno++;
-		if (hash_idx == -1) {
+		if (hash_idx == -1 && stop < 0) {
 			if (lineno % slices != sliceno) continue;
 		}
+		int linelen = 0;
+		if (copy) { // parsing destroys the line, keep it in case it is spilled
+			linelen = strlen(line);
+			memcpy(copy, line, linelen);
+			copy[linelen] = '\n';
+		}
 		char *field[field_count];
 		int field_len[field_count];
 		if (quote_support) {
@@ -211,12 +471,49 @@ int import_slice(const char *fn, const int slices, const int sliceno, const int
 		}
 		if (hash_idx != -1) {
 			int h = hash(field[hash_idx], field_len[hash_idx]) % slices;
-			if (h != sliceno) continue;
+			if (h != sliceno) {
+				if (spillfh[h]) {
+					err1(fwrite(copy, linelen + 1, 1, spillfh[h]) != 1);
+				}
+				continue;
+			}
+		}
+		if (col_types) {
+			for (int i = 0; i < field_count; i++) {
+				const int t = col_types[i];
+				if (!outfh[i] || t == TYPED_BYTES) continue;
+				if (t == TYPED_BYTESSTRIP) {
+					char *ptr = field[i];
+					int len = field_len[i];
+					while (len && (*ptr == 32 || (*ptr >= 9 && *ptr <= 13))) {
+						ptr++;
+						len--;
+					}
+					while (len && (ptr[len - 1] == 32 || (ptr[len - 1] >= 9 && ptr[len - 1] <= 13))) len--;
+					ptr[len] = '\n';
+					field[i] = ptr;
+					field_len[i] = len;
+					continue;
+				}
+				field[i][field_len[i]] = 0;
+				converted[i] = typeinfo[t].conv(field[i], convbuf[i], col_fmts[i]);
+				if (!converted[i]) {
+					if (!col_defaults[i] && !col_default_none[i]) goto bad;
+					converted[i] = defbuf[i];
+					res_num[2]++;
+				}
+			}
 		}
 		for (int i = 0; i < field_count; i++) {
 			if (outfh[i]) {
-				const int len = field_len[i] + 1;
-				err1(gzwrite(outfh[i], field[i], len) != len);
+				if (col_types && col_types[i] >= 0) {
+					const typeinfo_t *ti = &typeinfo[col_types[i]];
+					ti->minmax(converted[i], minmax_buf + i * 16, minmax_buf + i * 16 + 8);
+					err1(gzwrite(outfh[i], converted[i], ti->size) != ti->size);
+				} else {
+					const int len = field_len[i] + 1;
+					err1(gzwrite(outfh[i], field[i], len) != len);
+				}
 			}
 		}
 		res_num[1]++;
@@ -232,17 +529,188 @@ err:
 	for (int i = 0; i < field_count; i++) {
 		if (outfh[i] && gzclose(outfh[i])) res = 1;
 	}
-	gzclose(g.fh);
+	for (int i = 0; i < slices; i++) {
+		if (spillfh[i] && fclose(spillfh[i])) res = 1;
+	}
+	free(copy);
+	close_g(&g);
 	PyGILState_Release(gstate);
 	return res;
 }
+
+// Inflate the whole file, writing an access point (compressed offset,
+// uncompressed offset, bits, window) every span bytes of output.
+// (This is the method from zran.c in the zlib examples.)
+int build_gz_index(const char *fn, const int64_t span, const char *out_fn, int64_t *res_size)
+{
+	int res = 1;
+	int inited = 0;
+	unsigned char *input = malloc(Z);
+	unsigned char *window = malloc(WINSIZE);
+	unsigned char *point_window = malloc(WINSIZE);
+	FILE *in = fopen(fn, "rb");
+	FILE *out = fopen(out_fn, "wb");
+	err1(!input || !window || !point_window || !in || !out);
+	z_stream strm;
+	memset(&strm, 0, sizeof(strm));
+	err1(inflateInit2(&strm, 47) != Z_OK);
+	inited = 1;
+	int64_t totin = 0, totout = 0, last = 0;
+	int member_end = 0;
+	while (1) {
+		if (!strm.avail_in) {
+			strm.avail_in = fread(input, 1, Z, in);
+			strm.next_in = input;
+			if (!strm.avail_in) break;
+		}
+		if (!strm.avail_out) {
+			strm.avail_out = WINSIZE;
+			strm.next_out = window;
+		}
+		totin += strm.avail_in;
+		totout += strm.avail_out;
+		const int ret = inflate(&strm, Z_BLOCK);
+		totin -= strm.avail_in;
+		totout -= strm.avail_out;
+		if (ret == Z_STREAM_END) {
+			// another member may follow
+			err1(inflateReset(&strm) != Z_OK);
+			member_end = 1;
+			continue;
+		}
+		if (ret == Z_DATA_ERROR && member_end) break; // garbage after the last member
+		err1(ret != Z_OK);
+		member_end = 0;
+		if ((strm.data_type & 128) && !(strm.data_type & 64) && totout - last >= span) {
+			const int64_t offsets[2] = {totin, totout};
+			const int32_t bits = strm.data_type & 7;
+			const unsigned left = strm.avail_out;
+			if (left) memcpy(point_window, window + WINSIZE - left, left);
+			if (left < WINSIZE) memcpy(point_window + left, window, WINSIZE - left);
+			err1(fwrite(offsets, sizeof(offsets), 1, out) != 1);
+			err1(fwrite(&bits, sizeof(bits), 1, out) != 1);
+			err1(fwrite(point_window, WINSIZE, 1, out) != 1);
+			last = totout;
+		}
+	}
+	err1(!member_end); // truncated file
+	*res_size = totout;
+	res = 0;
+err:
+	if (inited) inflateEnd(&strm);
+	if (out && fclose(out)) res = 1;
+	if (in) fclose(in);
+	free(point_window);
+	free(window);
+	free(input);
+	return res;
+}
 ''', libraries=['z'], extra_compile_args=['-std=c99'])
 
-def prepare(SOURCE_DIRECTORY):
+GZ_INDEX_SPAN = 4 * 1024 * 1024
+_gz_point = struct.Struct('=qqi')
+
+def _gz_index(filename):
+	"""(uncompressed size, [(in, bits, out, zlib compressed window), ...])"""
+	import zlib
+	st = os.stat(filename)
+	key = (st.st_size, st.st_mtime, GZ_INDEX_SPAN,)
+	idx_filename = filename + '.gzidx'
+	if options.gz_index_cache:
+		try:
+			with open(idx_filename, 'rb') as fh:
+				cached = pickle.load(fh)
+			if cached['key'] == key:
+				return cached['size'], cached['points']
+		except (IOError, EOFError, pickle.UnpicklingError):
+			pass
+	res_size = ffi.new('int64_t [1]')
+	points_filename = 'gzidx.%d.tmp' % (os.getpid(),)
+	err = backend.build_gz_index(filename, GZ_INDEX_SPAN, points_filename.encode('ascii'), res_size)
+	assert not err, "c build_gz_index returned error"
+	points = []
+	with open(points_filename, 'rb') as fh:
+		while True:
+			data = fh.read(_gz_point.size)
+			if not data:
+				break
+			in_pos, out_pos, bits = _gz_point.unpack(data)
+			points.append((in_pos, bits, out_pos, zlib.compress(fh.read(32768)),))
+	os.unlink(points_filename)
+	if not options.gz_index_cache:
+		return res_size[0], points
+	try:
+		tmp_filename = '%s.%d.tmp' % (idx_filename, os.getpid(),)
+		with open(tmp_filename, 'wb') as fh:
+			pickle.dump(dict(key=key, size=res_size[0], points=points), fh, 2)
+		os.rename(tmp_filename, idx_filename)
+	except (IOError, OSError):
+		pass # not writable, so no cache
+	return res_size[0], points
+
+_WHOLE_FILE = (0, 2 ** 63 - 1, None,)
+
+def _spill_filename(dwix, src_sliceno, dst_sliceno):
+	return 'spill.%d.%d.%d' % (dwix, src_sliceno, dst_sliceno,)
+
+def _spill_done_filename(sliceno):
+	return 'spill.%d.done' % (sliceno,)
+
+
+def _expand_filenames(SOURCE_DIRECTORY):
+	res = []
+	for pattern in [options.filename] + list(options.filenames):
+		pattern = os.path.join(SOURCE_DIRECTORY, pattern)
+		if set('*?[') & set(pattern):
+			matches = sorted(glob(pattern))
+			assert matches, 'No files match %r' % (pattern,)
+			res.extend(matches)
+		else:
+			res.append(pattern)
+	assert len(set(res)) == len(res), 'Duplicate files: %r' % (res,)
+	return res
+
+
+def _assign_files(filenames, slices):
+	"""Whole files to slices, biggest first to the least loaded slice."""
+	work = [[] for _ in range(slices)]
+	load = [(0, sliceno) for sliceno in range(slices)]
+	for size, ix in sorted(((os.path.getsize(fn), ix) for ix, fn in enumerate(filenames)), reverse=True):
+		total, sliceno = heapq.heappop(load)
+		work[sliceno].append(ix)
+		heapq.heappush(load, (total + size, sliceno))
+	return [sorted(ixes) for ixes in work] # keep file order within each slice
+
+
+def _first_line(filename):
+	with gzutil.GzBytesLines(filename, strip_bom=True) as fh:
+		return next(fh).decode('ascii', 'replace').encode('ascii', 'replace') # garbage -> '?'
+
+
+def _typing(colname):
+	"""(dataset type, col_types value, fmt) for colname"""
+	coltype = options.column2type.get(colname, 'bytes')
+	if ':' in coltype and not coltype.startswith('number:'):
+		shortname, fmt = coltype.split(':', 1)
+	else:
+		shortname, fmt = coltype, None
+	desttype = dataset_typing.typerename.get(shortname, shortname)
+	if shortname == 'bytes':
+		return desttype, TYPED_BYTES, None
+	if shortname == 'bytesstrip':
+		return desttype, TYPED_BYTESSTRIP, None
+	assert shortname in typed_names and '%f' not in (fmt or ''), "Can't convert %s to %s while importing, use dataset_type" % (colname, coltype,)
+	return desttype, typed_names.index(shortname), fmt
+
+
+def prepare(SOURCE_DIRECTORY, params):
 	separator = options.separator
 	assert len(separator) == 1
-	filename  = os.path.join(SOURCE_DIRECTORY, options.filename)
-	orig_filename = filename
+	orig_filenames = _expand_filenames(SOURCE_DIRECTORY)
+	filenames = list(orig_filenames)
+	filename = orig_filename = filenames[0]
+	if len(filenames) > 1:
+		assert not any(fn.lower().endswith('.zip') for fn in filenames), 'ZIP files can only be imported one at a time'
 
 	if filename.lower().endswith('.zip'):
 		from zipfile import ZipFile
@@ -258,10 +726,12 @@ def prepare(SOURCE_DIRECTORY):
 					if not data:
 						break
 					ofh.write(data)
+		filenames = [filename]
 
 	if options.labelsonfirstline:
-		with gzutil.GzBytesLines(filename, strip_bom=True) as fh:
-			labels_str = next(fh).decode('ascii', 'replace').encode('ascii', 'replace') # garbage -> '?'
+		labels_str = _first_line(filename)
+		for fn in filenames[1:]:
+			assert _first_line(fn) == labels_str, 'First line in %s differs from %s' % (fn, filename,)
 		if options.quote_support:
 			labels = []
 			sep = options.separator
@@ -298,66 +768,273 @@ def prepare(SOURCE_DIRECTORY):
 	labels = [options.rename.get(x, x) for x in labels]
 	assert '' not in labels, "Empty label for column %d" % (labels.index(''),)
 	assert len(labels) == len(set(labels)), "Duplicate labels: %r" % (labels,)
+	for colname in options.column2type:
+		assert colname in labels and colname not in options.discard, "Column %r to type not imported" % (colname,)
+	for colname in options.defaults:
+		assert colname in options.column2type, "Default for untyped column %r" % (colname,)
+	# The slicing hashes the bytes we read, so that is what the column must contain.
+	assert _typing(options.hashlabel)[1] == TYPED_BYTES, "Can't type the hashlabel while importing"
+	columns = {n: _typing(n)[0] for n in labels}
 
-	dw = DatasetWriter(
-		columns={n: 'bytes' for n in labels},
-		filename=orig_filename,
-		hashlabel=options.hashlabel,
-		caption='csvimport of ' + orig_filename,
-		previous=datasets.previous,
-		meta_only=True,
-	)
+	if options.as_chain:
+		dws = []
+		previous = datasets.previous
+		for ix, fn in enumerate(orig_filenames):
+			name = 'default' if ix == len(orig_filenames) - 1 else str(ix)
+			dws.append(DatasetWriter(
+				columns=columns,
+				filename=fn,
+				hashlabel=options.hashlabel,
+				caption='csvimport of ' + fn,
+				previous=previous,
+				name=name,
+				meta_only=True,
+			))
+			previous = (params.jobid, name)
+	else:
+		dws = [DatasetWriter(
+			columns=columns,
+			filename=orig_filename,
+			hashlabel=options.hashlabel,
+			caption='csvimport of ' + orig_filename,
+			previous=datasets.previous,
+			meta_only=True,
+		)]
+
+	# work[sliceno] is a list of (fileix, dwix, (start, stop, point)).
+	# A range of None is the old way, with every slice reading all lines.
+	if len(filenames) > 1:
+		work = [[(ix, ix if options.as_chain else 0, _WHOLE_FILE) for ix in ixes] for ixes in _assign_files(filenames, params.slices)]
+	elif options.single_read:
+		with open(filename, 'rb') as fh:
+			magic = fh.read(2)
+		if magic == b'\x1f\x8b':
+			size, points = _gz_index(filename)
+		else:
+			size, points = os.path.getsize(filename), []
+		work = []
+		for sliceno in range(params.slices):
+			start = size * sliceno // params.slices
+			# last point from which we can get to the byte before start
+			ix = bisect_right([p[2] for p in points], start - 1)
+			point = points[ix - 1] if start and ix else None
+			work.append([(0, 0, (start, size * (sliceno + 1) // params.slices, point,))])
+	else:
+		work = [[(0, 0, None)]] * params.slices
+	spill = bool(options.hashlabel) and (len(filenames) > 1 or options.single_read)
+
+	return separator, filenames, orig_filenames, labels, dws, work, spill,
+
+
+def _bytes(v):
+	return v.encode('utf-8') if isinstance(v, unicode) else v
+
+
+def _mkunpack(fmt):
+	unpack = struct.Struct('=' + fmt).unpack
+	def decode(data):
+		return unpack(data)[0]
+	return decode
+
+_unpack_u32 = _mkunpack('I')
+_unpack_u32x2 = struct.Struct('=II').unpack
+
+def _decode_date(data):
+	from datetime import date
+	v = _unpack_u32(data)
+	return date(v >> 9, (v >> 5) & 15, v & 31)
+
+def _decode_datetime(data):
+	from datetime import datetime
+	i0, i1 = _unpack_u32x2(data)
+	return datetime(i0 >> 14, (i0 >> 10) & 15, (i0 >> 5) & 31, i0 & 31, i1 >> 26, (i1 >> 20) & 63, i1 & 0xfffff)
 
-	return separator, filename, orig_filename, labels, dw,
+def _decode_time(data):
+	from datetime import time
+	i0, i1 = _unpack_u32x2(data)
+	return time(i0 & 31, i1 >> 26, (i1 >> 20) & 63, i1 & 0xfffff)
+
+# Decoders for the values in minmax_buf, for the types with C converters.
+_minmax_decoders = {
+	'int64'   : _mkunpack('q'),
+	'int32'   : _mkunpack('i'),
+	'bits64'  : _mkunpack('Q'),
+	'bits32'  : _mkunpack('I'),
+	'float64' : _mkunpack('d'),
+	'float32' : _mkunpack('f'),
+	'bool'    : _mkunpack('?'),
+	'date'    : _decode_date,
+	'datetime': _decode_datetime,
+	'time'    : _decode_time,
+}
+
+
+class _SliceImport(object):
+	"""The C arguments (and results) for importing into one slice of dws."""
+
+	def __init__(self, labels, dws, sliceno):
+		self.n_labels = len(labels)
+		self.labels = labels
+		if options.column2type:
+			self.typing = [_typing(n) for n in labels]
+			self.col_types = ffi.new('int []', [t for _, t, _ in self.typing])
+			self.col_fmts = [ffi.new('char []', _bytes(fmt)) if fmt else ffi.NULL for _, _, fmt in self.typing]
+			self.col_defaults = [ffi.NULL if options.defaults.get(n) is None else ffi.new('char []', _bytes(options.defaults[n])) for n in labels]
+			self.col_default_none = [n in options.defaults and options.defaults[n] is None for n in labels]
+		else:
+			self.col_types = self.col_fmts = self.col_defaults = self.col_default_none = ffi.NULL
+		self.res_nums = []
+		self.out_fns = []
+		self.minmax_bufs = []
+		for dw in dws:
+			res_num = ffi.new('uint64_t [3]')
+			res_num[0] = 0 # broken_lines
+			res_num[1] = 0 # copied_lines
+			res_num[2] = 0 # defaulted values
+			self.res_nums.append(res_num)
+			self.out_fns.append([ffi.NULL if l in options.discard else ffi.new('char []', dw.column_filename(l, sliceno).encode('ascii')) for l in labels])
+			if options.column2type:
+				minmax_buf = ffi.new('char []', 16 * self.n_labels)
+				backend.setup_minmax(self.n_labels, self.col_types, minmax_buf)
+			else:
+				minmax_buf = ffi.NULL
+			self.minmax_bufs.append(minmax_buf)
+
+	def run(self, dwix, filename, slices, sliceno, skip_line, separator, hash_ix, start=0, stop=-1, spill_fns=ffi.NULL, idx_in=0, idx_bits=0, idx_out=0, idx_window=ffi.NULL):
+		err = backend.import_slice(filename, slices, sliceno, skip_line, self.n_labels, self.out_fns[dwix], separator, hash_ix, self.res_nums[dwix], options.quote_support, start, stop, spill_fns, idx_in, idx_bits, idx_out, idx_window, self.col_types, self.col_fmts, self.col_defaults, self.col_default_none, self.minmax_bufs[dwix])
+		assert not err, "c import_slice returned error"
+
+	def result(self):
+		minmax_per_dataset = []
+		for res_num, minmax_buf in zip(self.res_nums, self.minmax_bufs):
+			minmax = {}
+			if options.column2type:
+				for ix, (colname, (coltype, t, _)) in enumerate(zip(self.labels, self.typing)):
+					if t < 0 or colname in options.discard:
+						continue
+					if not res_num[1]:
+						minmax[colname] = (None, None,)
+						continue
+					size = dataset_typing.typesizes[coltype]
+					decode = _minmax_decoders[coltype]
+					data = ffi.buffer(minmax_buf + ix * 16, 16)[:]
+					minmax[colname] = (decode(data[:size]), decode(data[8:8 + size]),)
+			minmax_per_dataset.append(minmax)
+		return dict(
+			num_broken_lines = sum(res_num[0] for res_num in self.res_nums),
+			num_lines        = sum(res_num[1] for res_num in self.res_nums),
+			num_defaulted    = sum(res_num[2] for res_num in self.res_nums),
+			lines_per_dataset = [res_num[1] for res_num in self.res_nums],
+			minmax_per_dataset = minmax_per_dataset,
+		)
 
 
 def analysis(sliceno, prepare_res, params):
-	""" reading complete file, writing to this slice only"""
+	""" reading complete file (or our part of the files), writing to this slice only"""
 
-	separator, filename, _, labels, dw = prepare_res
+	separator, filenames, _, labels, dws, work, spill = prepare_res
 
 	if options.hashlabel:
 		hash_ix = labels.index(options.hashlabel)
 	else:
 		hash_ix = -1
 
-	copied_lines = 0
-	n_labels = len(labels)
+	imp = _SliceImport(labels, dws, sliceno)
+	for fileix, dwix, fileslice in work[sliceno]:
+		if fileslice:
+			start, stop, point = fileslice
+		else:
+			start, stop, point = 0, -1, None
+		if point:
+			import zlib
+			idx_in, idx_bits, idx_out, window = point
+			idx_window = ffi.new('unsigned char []', zlib.decompress(window))
+		else:
+			idx_in, idx_bits, idx_out, idx_window = 0, 0, 0, ffi.NULL
+		if spill:
+			spill_fns = [ffi.NULL if dst == sliceno else ffi.new('char []', _spill_filename(dwix, sliceno, dst).encode('ascii')) for dst in range(params.slices)]
+		else:
+			spill_fns = ffi.NULL
+		imp.run(dwix, filenames[fileix], params.slices, sliceno, options.labelsonfirstline, separator, hash_ix, start, stop, spill_fns, idx_in, idx_bits, idx_out, idx_window)
+	if spill:
+		# Our spill files are complete, synthesis imports them.
+		open(_spill_done_filename(sliceno), 'wb').close()
+	return imp.result()
+
+
+_spill_state = None
 
-	res_num = ffi.new('uint64_t [2]')
-	res_num[0] = 0 # broken_lines
-	res_num[1] = copied_lines
-	out_fns = [ffi.NULL if l in options.discard else ffi.new('char []', dw.column_filename(l).encode('ascii')) for l in labels]
-	err = backend.import_slice(filename, params.slices, sliceno, options.labelsonfirstline, n_labels, out_fns, separator, hash_ix, res_num, options.quote_support)
-	assert not err, "c import_slice returned error"
+def _import_spilled(sliceno):
+	"""Import what the other slices spilled to sliceno (in a pool worker)"""
+	separator, labels, dws, slices = _spill_state
+	imp = _SliceImport(labels, dws, sliceno)
+	for dwix in range(len(dws)):
+		for src in range(slices):
+			fn = _spill_filename(dwix, src, sliceno)
+			if src != sliceno and os.path.exists(fn):
+				imp.run(dwix, fn.encode('ascii'), 1, 0, False, separator, -1)
+				os.unlink(fn)
+	return imp.result()
 
-	res = dict(
-		num_broken_lines = res_num[0],
-		num_lines        = res_num[1],
+
+def _merge_res(a, b):
+	return dict(
+		num_broken_lines = a['num_broken_lines'] + b['num_broken_lines'],
+		num_lines        = a['num_lines'] + b['num_lines'],
+		num_defaulted    = a['num_defaulted'] + b['num_defaulted'],
+		lines_per_dataset = [x + y for x, y in zip(a['lines_per_dataset'], b['lines_per_dataset'])],
+		minmax_per_dataset = [_merge_minmax(x, y) for x, y in zip(a['minmax_per_dataset'], b['minmax_per_dataset'])],
 	)
-	return res
 
+def _merge_minmax(a, b):
+	res = {}
+	for colname in set(a) | set(b):
+		mins, maxs = zip(*(x[colname] for x in (a, b) if colname in x))
+		mins = [v for v in mins if v is not None]
+		maxs = [v for v in maxs if v is not None]
+		res[colname] = (min(mins) if mins else None, max(maxs) if maxs else None,)
+	return res
 
 
 def synthesis(prepare_res, analysis_res, params):
 	from math import sqrt
 
-	separator, filename, orig_filename, labels, dw = prepare_res
-	labels = [n for n in labels if n not in options.discard]
+	separator, filenames, orig_filenames, labels_all, dws, work, spill = prepare_res
+	labels = [n for n in labels_all if n not in options.discard]
 
-	if filename != orig_filename:
-		os.unlink(filename)
+	if filenames[0] != orig_filenames[0]:
+		os.unlink(filenames[0])
+	if spill:
+		# All slices have finished their spill files, so the second pass
+		# can't miss lines. A slice that didn't finish is an error here
+		# instead of something to wait for.
+		missing = [sliceno for sliceno in range(params.slices) if not os.path.exists(_spill_done_filename(sliceno))]
+		assert not missing, 'Slices %r did not finish their spill files' % (missing,)
+		global _spill_state
+		_spill_state = (separator, labels_all, dws, params.slices,)
+		from safe_pool import Pool
+		pool = Pool(processes=params.slices)
+		spilled = pool.map(_import_spilled, range(params.slices))
+		pool.close()
+		for sliceno in range(params.slices):
+			os.unlink(_spill_done_filename(sliceno))
+		analysis_res = [_merge_res(a, b) for a, b in zip(analysis_res, spilled)]
 
 	# aggregate typing and statistics
 	res = {}
 	res['num_broken_lines'] = 0
 	res['num_lines'] = 0
+	res['num_defaulted'] = 0
 	res['lines_per_slice'] = []
 	for sliceno, tmp in enumerate(analysis_res):
 		res['num_broken_lines'] += tmp['num_broken_lines']
 		res['num_lines']        += tmp['num_lines']
+		res['num_defaulted']    += tmp['num_defaulted']
 		res['lines_per_slice'].append(tmp['num_lines'])
-		dw.set_lines(sliceno, tmp['num_lines'])
+		for dw, lines, minmax in zip(dws, tmp['lines_per_dataset'], tmp['minmax_per_dataset']):
+			dw.set_lines(sliceno, lines)
+			if minmax:
+				dw.set_minmax(sliceno, minmax)
 
 	blob.save(res, 'import')
 
@@ -380,6 +1057,11 @@ def synthesis(prepare_res, analysis_res, params):
 	r.line()
 
 	r.println('Number of columns              %9d' % len(labels,))
+	if len(filenames) > 1:
+		r.println('Number of files                %9d' % len(filenames,))
+	if options.column2type:
+		r.println('Number of typed columns        %9d' % len(options.column2type,))
+		r.println('Number of defaulted values     %9d' % (res['num_defaulted'],))
 	r.close()
 
 	if res['num_broken_lines'] and not options.allow_bad:
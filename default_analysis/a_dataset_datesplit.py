@@ -339,6 +339,8 @@ def process_one(sliceno, options, source, prepare_res, data=None, save_discard=F
 	for colname in column_names:
 		out_fn = dw.column_filename(colname, sliceno).encode('ascii')
 		in_fn = d.column_filename(colname, sliceno).encode('ascii')
+		assert d.columns[colname].codec in (None, 'gzip', 'raw',), "Can't split %s columns, only gzip or raw" % (d.columns[colname].codec,)
+		assert not d._grouped(colname), "Can't split %s, it is in a column group" % (colname,)
 		offset = d.columns[colname].offsets[sliceno] if d.columns[colname].offsets else 0
 		in_files.append(ffi.new('char []', in_fn))
 		out_files.append(ffi.new('char []', out_fn))
@@ -26,16 +26,23 @@ from shutil import copyfileobj
 
 from extras import OptionString, job_params
 from dataset import DatasetWriter
+from gzwrite import sidecar_type, delta_type
 
 options = {
 	'hashlabel'                 : OptionString,
 	'caption'                   : '"%(caption)s" hashed on %(hashlabel)s',
 	'length'                    : -1, # Go back at most this many datasets. You almost always want -1 (which goes until previous.source)
-	'as_chain'                  : False, # one dataset per slice (avoids rewriting at the end)
+	'as_chain'                  : False, # one dataset per slice (avoids rewriting at the end), always for dictionary encoded, list/set, heap and delta columns
 }
 
 datasets = ('source', 'previous',)
 
+def unmergeable(typename):
+	# The per slice datasets of these can't just be concatenated, each
+	# has its own dictionary, list values or heap (with offsets into it),
+	# and delta encoding continues from the previous value.
+	return sidecar_type(typename) or delta_type(typename)
+
 def prepare(params):
 	d = datasets.source
 	caption = options.caption % dict(caption=d.caption, hashlabel=options.hashlabel)
@@ -45,10 +52,11 @@ def prepare(params):
 		filename = d.filename
 	else:
 		filename = None
+	as_chain = options.as_chain or any(unmergeable(c.type) for c in d.columns.values())
 	dws = []
 	previous = datasets.previous
 	for sliceno in range(params.slices):
-		if options.as_chain and sliceno == params.slices - 1:
+		if as_chain and sliceno == params.slices - 1:
 			name = "default"
 		else:
 			name = str(sliceno)
@@ -69,7 +77,7 @@ def prepare(params):
 		names.append(n)
 		for dw in dws:
 			dw.add(n, c.type)
-	return dws, names, prev_source, caption, filename
+	return dws, names, prev_source, caption, filename, as_chain
 
 def analysis(sliceno, prepare_res):
 	dws, names, prev_source = prepare_res[:3]
@@ -78,16 +86,18 @@ def analysis(sliceno, prepare_res):
 		names,
 		stop_jobid=prev_source,
 		length=options.length,
+		batch_size=65536,
+		batch_columns=True,
 	)
-	write = dws[sliceno].get_split_write_list()
-	for values in it:
-		write(values)
+	write = dws[sliceno].split_write_columns
+	for columns in it:
+		write(*columns)
 
 def synthesis(prepare_res, params):
-	if not options.as_chain:
+	dws, names, prev_source, caption, filename, as_chain = prepare_res
+	if not as_chain:
 		# If we don't want a chain we abuse our knowledge of dataset internals
 		# to avoid recompressing. Don't do this stuff yourself.
-		dws, names, prev_source, caption, filename = prepare_res
 		merged_dw = DatasetWriter(
 			caption=caption,
 			hashlabel=options.hashlabel,
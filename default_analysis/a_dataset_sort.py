@@ -21,13 +21,14 @@
 
 from __future__ import division
 
-from numpy import lexsort
+from numpy import lexsort, concatenate, isnan, isnat
 from os import symlink
 from functools import partial
 
 from extras import OptionEnum, OptionString
 from jobid import resolve_jobid_filename
 from dataset import Dataset, DatasetWriter
+from sourcedata import type2array, type2iter
 
 OrderEnum = OptionEnum('ascending descending')
 
@@ -35,20 +36,39 @@ options = {
 	'sort_columns'           : [OptionString],
 	'sort_order'             : OrderEnum.ascending,
 	'sort_across_slices'     : False, # normally only sort within slices
+	'delta_encode'           : False, # write int64/int32/date/datetime sort columns delta encoded (small when sorted)
 }
 datasets = ('source', 'previous',)
 
 
-def sort(columniter):
+# Fixed width types that sort the same as numpy arrays as they do as
+# python objects. Not bool (None becomes False) or the dictionary encoded
+# types (column_array gives the codes, not the values).
+fast_types = set(type2array) - {'bool', 'bytes:dict', 'ascii:dict', 'unicode:dict'}
+
+def has_none(arr):
+	# None is NaN/NaT in the array, which doesn't sort where None does.
+	if arr.dtype.kind == 'f':
+		return isnan(arr).any()
+	elif arr.dtype.kind in 'mM':
+		return isnat(arr).any()
+	return False
+
+def sort(columniter, sliceno, jobs):
 	def sortable_columnlist(column):
-		if datasets.source.columns[column] in ('datetime', 'date', 'time',):
-			return map(str, columniter(column))
+		if all(d.columns[column].type in fast_types for d in jobs):
+			# Fixed width types can skip making python objects.
+			arr = concatenate([d.column_array(sliceno, column) for d in jobs])
+			if not has_none(arr):
+				return arr
+		if datasets.source.columns[column].type.split(':')[0] in ('datetime', 'date', 'time',):
+			return list(map(str, columniter(column)))
 		else:
 			return list(columniter(column))
 	lst = [sortable_columnlist(c) for c in reversed(options.sort_columns)]
 	if options.sort_order == 'descending':
 		# Stupid lexsort doesn't take a direction, and we want stable sorting.
-		[e.reverse() for e in lst]
+		lst = [e[::-1] for e in lst]
 		l = len(lst[0]) - 1
 		sort_idx = [l - i for i in reversed(lexsort(lst))]
 	else:
@@ -60,7 +80,7 @@ def prepare(params):
 	jobs = d.chain(stop_jobid={datasets.previous: 'source'})
 	if options.sort_across_slices:
 		columniter = partial(Dataset.iterate_list, None, jobids=jobs)
-		sort_idx = sort(columniter)
+		sort_idx = sort(columniter, None, jobs)
 	else:
 		sort_idx = None
 	if options.sort_across_slices:
@@ -71,8 +91,13 @@ def prepare(params):
 		filename = d.filename
 	else:
 		filename = None
+	columns = {k: c.type for k, c in d.columns.items()}
+	if options.delta_encode:
+		for k in options.sort_columns:
+			if columns[k] + ':delta' in type2iter:
+				columns[k] += ':delta'
 	dw = DatasetWriter(
-		columns=d.columns,
+		columns=columns,
 		caption=params.caption,
 		hashlabel=hashlabel,
 		filename=filename,
@@ -91,8 +116,8 @@ def analysis(sliceno, params, prepare_res):
 			sort_idx = sort_idx[per_slice * sliceno:per_slice * (sliceno + 1)]
 	else:
 		columniter = partial(Dataset.iterate_list, sliceno, jobids=jobs)
-		sort_idx = sort(columniter)
-	if single_job and not options.sort_across_slices and sort_idx == sorted(sort_idx):
+		sort_idx = sort(columniter, sliceno, jobs)
+	if single_job and not options.sort_across_slices and not options.delta_encode and sort_idx == sorted(sort_idx):
 		# this slice is fully sorted as is.
 		slice_dir = '%02d' % (sliceno,)
 		symlink(resolve_jobid_filename(datasets.source, slice_dir), slice_dir)
@@ -56,6 +56,7 @@ options = {
 	'discard_untyped'           : bool, # Make unconverted columns inaccessible ("new" dataset)
 	'filter_bad'                : False, # Implies discard_untyped
 	'numeric_comma'             : False, # floats as "3,14"
+	'narrow_numbers'            : False, # number columns with only ints or only floats become int64 or float64
 }
 
 datasets = ('source', 'previous',)
@@ -559,6 +560,7 @@ def prepare():
 		parent=parent,
 		previous=datasets.previous,
 		meta_only=True,
+		narrow_numbers=options.narrow_numbers,
 	)
 
 def analysis(sliceno):
@@ -623,6 +625,8 @@ def analysis_lap(sliceno, badmap_fh, first_lap):
 				badmap_fh.truncate(badmap_size)
 				badmap_fd = badmap_fh.fileno()
 		in_fn = d.column_filename(colname, sliceno).encode('ascii')
+		assert d.columns[colname].codec in (None, 'gzip', 'raw',), "Can't convert %s columns, only gzip or raw" % (d.columns[colname].codec,)
+		assert not d._grouped(colname), "Can't convert %s, it is in a column group" % (colname,)
 		if d.columns[colname].offsets:
 			offset = d.columns[colname].offsets[sliceno]
 			max_count = d.lines[sliceno]
@@ -20,7 +20,7 @@ from __future__ import print_function
 from __future__ import division
 
 import gzutil
-from compat import unicode, str_types, PY3
+from compat import unicode, str_types, num_types, PY3, imap, izip
 
 GzWrite = gzutil.GzWrite
 
@@ -59,7 +59,131 @@ def typed_reader(typename):
 		raise ValueError("Unknown reader for type %s" % (typename,))
 	return type2iter[typename]
 
+# Column compression (DatasetWriter(compression=...)) can be
+#     'gzip' or 'gzip:level' (what gzutil normally writes),
+#     'raw' for no compression (the numpy reader can mmap fixed width
+#           columns, and sourcedata.open_column makes sure gzutil doesn't
+#           take data that happens to start with the gzip magic for gzip),
+#     'bz2' or 'lzma' for cold data (written raw, compressed on close).
+# The codec part (before any ':') is stored in the DatasetColumn.
+codecs = ('gzip', 'raw', 'bz2', 'lzma',)
+
+def compression_mode(compression):
+	"""Returns (codec, mode) where mode is what to pass to the
+	gzutil writers (or None for the default)."""
+	codec, _, level = (compression or 'gzip').partition(':')
+	if codec not in codecs:
+		raise ValueError("Unknown compression %s" % (compression,))
+	if codec == 'gzip':
+		if not level:
+			return codec, None
+		if len(level) != 1 or not level.isdigit():
+			raise ValueError("Bad gzip level in compression %s" % (compression,))
+		return codec, 'w' + level
+	if level:
+		raise ValueError("Compression %s does not take a level" % (compression,))
+	if codec == 'lzma':
+		_lzma() # fail now, not after writing everything
+	# zlib writes uncompressed files in "transparent" mode
+	return codec, 'w1T'
+
+def _compress_in_place(fn, c, codec=None):
+	# codec is what fn is compressed with now (None for not at all).
+	import os
+	from sourcedata import _decompressed_chunks
+	tmp_fn = '%s.%dtmp' % (fn, os.getpid(),)
+	with open(tmp_fn, 'wb') as out_fh:
+		if codec:
+			chunks = _decompressed_chunks(fn, codec, 0, None, 1048576)
+		else:
+			chunks = _file_chunks(fn)
+		for data in chunks:
+			out_fh.write(c.compress(bytes(data)))
+		out_fh.write(c.flush())
+	os.rename(tmp_fn, fn)
+
+def _file_chunks(fn):
+	with open(fn, 'rb') as fh:
+		while True:
+			data = fh.read(1048576)
+			if not data:
+				return
+			yield data
+
+def _lzma():
+	try:
+		import lzma
+	except ImportError:
+		raise ImportError("lzma compression needs the lzma module (python 3)")
+	return lzma
+
+def recompress(fn, codec):
+	"""Compress fn (written with mode from compression_mode) in place
+	if codec is one that gzutil can not write directly."""
+	if codec == 'bz2':
+		from bz2 import BZ2Compressor as Compressor
+	elif codec == 'lzma':
+		Compressor = _lzma().LZMACompressor
+	else:
+		return
+	_compress_in_place(fn, Compressor())
+
+class GzWriteRecompress(object):
+	"""Wraps a typed writer (writing with the mode from compression_mode),
+	compressing the file with codec (see recompress) when closed. Closing
+	again does nothing."""
+	def __init__(self, w, fn, codec):
+		self._w = w
+		self._fn = fn
+		self._codec = codec
+		self._closed = False
+	def __getattr__(self, name):
+		# write, count, min, max and so on.
+		return getattr(self._w, name)
+	def close(self):
+		if not self._closed:
+			self._closed = True
+			self._w.close()
+			recompress(self._fn, self._codec)
+	def __enter__(self):
+		return self
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+def gzip_in_place(fn, level=None):
+	"""Recompress the gzip file fn (written with level 0 by
+	defer_compression) in place. The rename at the end is atomic, and the
+	contents are the same, so this is safe while fn is being read."""
+	from zlib import compressobj, DEFLATED, MAX_WBITS, Z_DEFAULT_COMPRESSION
+	if level is None:
+		level = Z_DEFAULT_COMPRESSION
+	_compress_in_place(fn, compressobj(level, DEFLATED, 16 + MAX_WBITS), 'gzip')
+
+def hash_array(values, hashfunc=None):
+	"""[hash, ...] for values (a sequence or numpy array), the same hashes
+	a writer would slice on. hashfunc is usually writer.hash, and defaults
+	to gzutil.hash (which picks the writer from the type of each value)."""
+	if hasattr(values, 'tolist'):
+		values = values.tolist()
+	return list(map(hashfunc or gzutil.hash, values))
+
+def slice_groups(targets, slices):
+	"""[[index, ...] per slice] for a sequence of target slice numbers."""
+	try:
+		import numpy
+	except ImportError:
+		groups = [[] for _ in range(slices)]
+		appends = [g.append for g in groups]
+		for ix, sliceno in enumerate(targets):
+			appends[sliceno](ix)
+		return groups
+	targets = numpy.asarray(targets, dtype=numpy.int64)
+	order = numpy.argsort(targets, kind='mergesort')
+	bounds = numpy.cumsum(numpy.bincount(targets, minlength=slices))[:-1]
+	return [g.tolist() for g in numpy.split(order, bounds)]
+
 def _mklistwriter(inner_type, seq_type, len_type):
+	from collections import deque
 	class GzWriteXList(object):
 		min = max = None
 		def __init__(self, *a, **kw):
@@ -75,8 +199,7 @@ def _mklistwriter(inner_type, seq_type, len_type):
 			assert llen < 65536, 'List too long (max 65535 elements)'
 			w = self.fh.write
 			w(len_type(llen))
-			for v in lst:
-				w(v)
+			deque(imap(w, lst), maxlen=0)
 		def close(self):
 			self.fh.close()
 		def __enter__(self):
@@ -90,7 +213,387 @@ for _seq_type in ('List', 'Set',):
 	_convfuncs['ascii'   + _seq_type.lower()] = _mklistwriter('Ascii'   , _seq_type, str)
 	_convfuncs['unicode' + _seq_type.lower()] = _mklistwriter('Unicode' , _seq_type, unicode)
 
+# Flat list and set types ("list:int64", "set:ascii" and so on) store
+# the length of each list (None for None) in an int32 column file, and
+# all the values after each other in fn + ".values" (a column of the
+# inner type). So the values are written and read by the typed writers
+# and readers directly, and fixed width values can be read as numpy
+# arrays, see sourcedata.list_arrays. (The older "numberlist" and so on
+# mix the lengths in with the values.)
+def _mkflatlistwriter(inner_type, seq_type):
+	from collections import deque
+	inner = _convfuncs[inner_type]
+	class GzWriteFlatXList(object):
+		min = max = None
+		def __init__(self, fn, mode=None, hashfilter=None, **kw):
+			assert not hashfilter, "%s:%s can't be the hashlabel" % (seq_type, inner_type,)
+			assert not kw, "default not supported for %s:%s, sorry" % (seq_type, inner_type,)
+			kw = {'mode': mode} if mode else {}
+			self.fh = gzutil.GzWriteInt32(fn, **kw)
+			self._values = inner(fn + '.values', **kw)
+			self.count = 0
+		def write(self, lst):
+			self.count += 1
+			if lst is None:
+				self.fh.write(None)
+			else:
+				self.fh.write(len(lst))
+				deque(imap(self._values.write, lst), maxlen=0)
+		def close(self):
+			if self.fh:
+				self.fh.close()
+				self._values.close()
+				self.fh = None
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzWriteFlatXList.__name__ = 'GzWrite%s%s' % (seq_type.capitalize(), inner_type.capitalize(),)
+	return GzWriteFlatXList
+flat_list_inner_types = ('number', 'int64', 'int32', 'float64', 'float32', 'bool', 'datetime', 'date', 'time', 'bytes', 'ascii', 'unicode',)
+for _seq_type in ('list', 'set',):
+	for _inner_type in flat_list_inner_types:
+		_convfuncs[_seq_type + ':' + _inner_type] = _mkflatlistwriter(_inner_type, _seq_type)
+
+def flat_list_type(typename):
+	"""True for the flat list and set types"""
+	return typename.startswith(('list:', 'set:',))
+
+# Dictionary encoded strings ("ascii:dict" and so on) store an int32 code
+# per value in the column file, and the values (in code order, with None
+# as code 0) in a per slice dictionary next to it. The dictionary is in
+# .dictionary after closing, and DatasetWriter saves it (fn + ".dict").
+# Good for columns with few distinct values.
+def _mkdictwriter(inner_type):
+	inner = _convfuncs[inner_type]
+	class GzWriteXDict(object):
+		min = max = None
+		def __init__(self, fn, mode=None, hashfilter=None, **kw):
+			import os
+			self._has_default = 'default' in kw
+			self._default = kw.pop('default', None)
+			assert not kw, "Unknown arguments %r" % (kw,)
+			if mode:
+				self.fh = gzutil.GzWriteInt32(fn, mode=mode)
+			else:
+				self.fh = gzutil.GzWriteInt32(fn)
+			# Only for checking and hashing new values.
+			self._check = inner(os.devnull)
+			self._hashfilter = hashfilter
+			self._codes = {}
+			self._mine = [True]
+			self.dictionary = [None]
+			self.count = 0
+		def _add(self, v):
+			try:
+				self._check.write(v)
+			except (TypeError, ValueError, OverflowError):
+				if not self._has_default:
+					raise
+				code = self._code(self._default)
+			else:
+				if v is None:
+					code = 0
+				else:
+					code = len(self.dictionary)
+					self.dictionary.append(v)
+					self._mine.append(True)
+				if self._hashfilter:
+					self._mine[code] = self.hashcheck(v)
+			self._codes[v] = code
+			return code
+		def _code(self, v):
+			try:
+				return self._codes[v]
+			except KeyError:
+				return self._add(v)
+		def write(self, v):
+			code = self._code(v)
+			if not self._mine[code]:
+				return False
+			self.fh.write(code)
+			self.count += 1
+			return True
+		def hash(self, v):
+			return self._check.hash(v)
+		def hashcheck(self, v):
+			sliceno, slices = self._hashfilter
+			return self._check.hash(v) % slices == sliceno
+		def close(self):
+			if self.fh:
+				self.fh.close()
+				self._check.close()
+				self.fh = self._codes = None
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzWriteXDict.__name__ = 'GzWrite%sDict' % (inner_type.capitalize(),)
+	return GzWriteXDict
+for _inner_type in ('bytes', 'ascii', 'unicode',):
+	_convfuncs[_inner_type + ':dict'] = _mkdictwriter(_inner_type)
+
+def dict_type(typename):
+	"""True for the dictionary encoded types"""
+	return typename.endswith(':dict')
+
+# Heap strings ("ascii:heap" and so on) store the encoded values one
+# after the other (no separators, so anything can be in them) in the
+# column file, and the end offset of each value in fn + ".offsets" (an
+# int64 column, None for None values). Readers can get at any value
+# without scanning, see sourcedata.heap_arrays.
+def _mkheapwriter(inner_type, encoding):
+	# encode checks the values like the inner writer would, so min/max
+	# are kept here (on the encoded values, which sort the same) and the
+	# inner writer is only used for .hash.
+	inner = _convfuncs[inner_type]
+	if inner_type == 'bytes':
+		def encode(v):
+			if not isinstance(v, bytes):
+				raise TypeError("Only bytes objects are accepted, not %r" % (v,))
+			return v
+	elif inner_type == 'ascii':
+		def encode(v):
+			if isinstance(v, bytes):
+				v.decode('ascii') # (only to check it)
+				return v
+			if isinstance(v, unicode):
+				return v.encode('ascii')
+			raise TypeError("Only strings are accepted, not %r" % (v,))
+	else:
+		def encode(v):
+			if not isinstance(v, unicode):
+				raise TypeError("Only unicode objects are accepted, not %r" % (v,))
+			return v.encode(encoding)
+	# the same types as the inner writer gives for min/max
+	decoding = encoding if PY3 or inner_type == 'unicode' else None
+	class GzWriteXHeap(object):
+		def __init__(self, fn, mode=None, hashfilter=None, **kw):
+			import os
+			self._has_default = 'default' in kw
+			self._default = kw.pop('default', None)
+			assert not kw, "Unknown arguments %r" % (kw,)
+			if mode:
+				self.fh = gzutil.GzWrite(fn, mode=mode)
+				self._ends = gzutil.GzWriteInt64(fn + '.offsets', mode=mode)
+			else:
+				self.fh = gzutil.GzWrite(fn)
+				self._ends = gzutil.GzWriteInt64(fn + '.offsets')
+			self._hasher = inner(os.devnull) # nothing is written to it
+			self._hashfilter = hashfilter
+			self._min = self._max = None
+			self._pos = 0
+			self.count = 0
+		@property
+		def min(self):
+			return self._min.decode(decoding) if decoding and self._min is not None else self._min
+		@property
+		def max(self):
+			return self._max.decode(decoding) if decoding and self._max is not None else self._max
+		def _valid(self, check, v):
+			try:
+				return check(v)
+			except (TypeError, ValueError, OverflowError):
+				if not self._has_default:
+					raise
+				return check(self._default)
+		def _encode(self, v):
+			return None if v is None else encode(v)
+		def write(self, v):
+			if self._hashfilter:
+				res = []
+				v = self._valid(lambda v: res.append(self.hashcheck(v)) or v, v)
+				if not res[-1]:
+					return False
+			data = self._valid(self._encode, v)
+			if data is None:
+				self._ends.write(None)
+			else:
+				if self._min is None or data < self._min:
+					self._min = data
+				if self._max is None or data > self._max:
+					self._max = data
+				self.fh.write(data)
+				self._pos += len(data)
+				self._ends.write(self._pos)
+			self.count += 1
+			return True
+		def hash(self, v):
+			return self._hasher.hash(v)
+		def hashcheck(self, v):
+			sliceno, slices = self._hashfilter
+			return self._hasher.hash(v) % slices == sliceno
+		def close(self):
+			if self.fh:
+				self.fh.close()
+				self._ends.close()
+				self._hasher.close()
+				self.fh = None
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzWriteXHeap.__name__ = 'GzWrite%sHeap' % (inner_type.capitalize(),)
+	return GzWriteXHeap
+_convfuncs['bytes:heap'] = _mkheapwriter('bytes', None)
+_convfuncs['ascii:heap'] = _mkheapwriter('ascii', 'ascii')
+_convfuncs['unicode:heap'] = _mkheapwriter('unicode', 'utf-8')
+
+def heap_type(typename):
+	"""True for the heap string types"""
+	return typename.endswith(':heap')
+
+def sidecar_type(typename):
+	"""True for types that keep something in files next to the column
+	file (so they can't be merged, blocked or bz2/lzma compressed)"""
+	return dict_type(typename) or heap_type(typename) or flat_list_type(typename)
+
+def column_files(typename, fn):
+	"""All the files a typename writer writes for the column file fn
+	(fn and any sidecars) with its mode, so all that need compressing."""
+	if heap_type(typename):
+		return [fn, fn + '.offsets']
+	if flat_list_type(typename):
+		return [fn, fn + '.values']
+	return [fn]
+
+# Delta encoded types ("int64:delta", "date:delta" and so on) store
+# (delta, run length) pairs in a number column, with each value as the
+# difference from the previous non-None value in the slice (None has a
+# delta of None). Sorted or slowly changing columns (ids, timestamps,
+# sort keys) become a few small numbers per run instead of 8 bytes per
+# value. Every writer starts over from 0 (and writes a (None, 0) pair
+# saying so first), so blocks (and merged slices) are readable on their
+# own, and blocks after each other are read correctly too.
+def _mkint2int(bits):
+	# Like the intNN writers: any number, truncated, that fits (the
+	# smallest value is None).
+	top = (1 << (bits - 1)) - 1
+	def to_int(v):
+		if not isinstance(v, num_types):
+			raise TypeError("Only numbers are accepted, not %r" % (v,))
+		v = int(v)
+		if not -top <= v <= top:
+			raise OverflowError("%d doesn't fit in int%d" % (v, bits,))
+		return v
+	return to_int
+
+def _date2int(v):
+	from datetime import date
+	if not isinstance(v, date):
+		raise TypeError("date object expected")
+	return v.toordinal()
+
+def _datetime2int(v):
+	from datetime import datetime
+	if not isinstance(v, datetime):
+		raise TypeError("datetime object expected")
+	d = v - datetime(1970, 1, 1)
+	return (d.days * 86400 + d.seconds) * 1000000 + d.microseconds
+
+def _int2date(v):
+	from sourcedata import _int2date
+	return _int2date(v)
+
+def _int2datetime(v):
+	from sourcedata import _int2datetime
+	return _int2datetime(v)
+
+def _mkdeltawriter(inner_type, to_int, from_int):
+	# to_int checks the values like the inner writer would, so min/max
+	# are kept here (as ints) and the inner writer is only used for .hash.
+	inner = _convfuncs[inner_type]
+	class GzWriteXDelta(object):
+		def __init__(self, fn, mode=None, hashfilter=None, **kw):
+			import os
+			self._has_default = 'default' in kw
+			self._default = kw.pop('default', None)
+			assert not kw, "Unknown arguments %r" % (kw,)
+			if mode:
+				self.fh = gzutil.GzWriteNumber(fn, mode=mode)
+			else:
+				self.fh = gzutil.GzWriteNumber(fn)
+			self.fh.write(None)
+			self.fh.write(0)
+			self._hasher = inner(os.devnull) # nothing is written to it
+			self._hashfilter = hashfilter
+			self._min = self._max = None
+			self._prev = 0
+			self._delta = None
+			self._run = 0
+			self.count = 0
+		@property
+		def min(self):
+			return self._min if self._min is None or not from_int else from_int(self._min)
+		@property
+		def max(self):
+			return self._max if self._max is None or not from_int else from_int(self._max)
+		def _valid(self, check, v):
+			try:
+				return check(v)
+			except (TypeError, ValueError, OverflowError):
+				if not self._has_default:
+					raise
+				return check(self._default)
+		def _to_int(self, v):
+			return None if v is None else to_int(v)
+		def write(self, v):
+			if self._hashfilter:
+				res = []
+				v = self._valid(lambda v: res.append(self.hashcheck(v)) or v, v)
+				if not res[-1]:
+					return False
+			v = self._valid(self._to_int, v)
+			if v is None:
+				delta = None
+			else:
+				if self._min is None or v < self._min:
+					self._min = v
+				if self._max is None or v > self._max:
+					self._max = v
+				delta = v - self._prev
+				self._prev = v
+			if self._run and delta == self._delta:
+				self._run += 1
+			else:
+				self._flush()
+				self._delta = delta
+				self._run = 1
+			self.count += 1
+			return True
+		def _flush(self):
+			if self._run:
+				self.fh.write(self._delta)
+				self.fh.write(self._run)
+		def hash(self, v):
+			return self._hasher.hash(v)
+		def hashcheck(self, v):
+			sliceno, slices = self._hashfilter
+			return self._hasher.hash(v) % slices == sliceno
+		def close(self):
+			if self.fh:
+				self._flush()
+				self.fh.close()
+				self._hasher.close()
+				self.fh = None
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzWriteXDelta.__name__ = 'GzWrite%sDelta' % (inner_type.capitalize(),)
+	return GzWriteXDelta
+_convfuncs['int64:delta'] = _mkdeltawriter('int64', _mkint2int(64), None)
+_convfuncs['int32:delta'] = _mkdeltawriter('int32', _mkint2int(32), None)
+_convfuncs['date:delta'] = _mkdeltawriter('date', _date2int, _int2date)
+_convfuncs['datetime:delta'] = _mkdeltawriter('datetime', _datetime2int, _int2datetime)
+
+def delta_type(typename):
+	"""True for the delta encoded types"""
+	return typename.endswith(':delta')
+
 from ujson import dumps, loads
+from compat import pickle
+pickle_dumps = pickle.dumps
 class GzWriteJson(object):
 	min = max = None
 	def __init__(self, *a, **kw):
@@ -120,3 +623,267 @@ class GzWriteParsedJson(GzWriteJson):
 		self.count += 1
 		self.fh.write(dumps(o, ensure_ascii=False))
 _convfuncs['parsed:json'] = GzWriteParsedJson
+
+class GzWritePickle(object):
+	"""Any (picklable) objects, one pickle after the other. Pickles know
+	where they end, so no framing is needed, and reading them back is a
+	lot faster than parsing json (and keeps bytes, datetimes, tuples and
+	so on as they were). Protocol 2, so python2 can read them too."""
+	min = max = None
+	def __init__(self, *a, **kw):
+		assert 'default' not in kw, "default not supported for pickle, sorry"
+		self.fh = gzutil.GzWrite(*a, **kw)
+		self.count = 0
+	def write(self, o):
+		self.count += 1
+		self.fh.write(pickle_dumps(o, 2))
+	def close(self):
+		self.fh.close()
+	def __enter__(self):
+		return self
+	def __exit__(self, type, value, traceback):
+		self.close()
+_convfuncs['pickle'] = GzWritePickle
+
+def _minmax_merge(a, b):
+	if a[0] is None:
+		return b
+	if b[0] is None:
+		return a
+	return min(a[0], b[0]), max(a[1], b[1])
+
+class GzWriteBlocked(object):
+	"""Wraps a typed writer, starting a new gzip member (in the same file)
+	every block_rows values. The (row, byte offset) where each block
+	starts is kept in .index, so readers can start at any block, together
+	with the min and max value of each block (a zone map), so readers can
+	skip blocks that don't have the values they want.
+	This costs an extra python call per value written."""
+	def __init__(self, wt, fn, block_rows, mode=None, **kw):
+		assert block_rows > 0, block_rows
+		self._mk = lambda mode: wt(fn, mode=mode, **kw)
+		mode = mode or 'w'
+		self._append_mode = 'a' + mode[1:]
+		self.fn = fn
+		self.block_rows = block_rows
+		self.index = {'rows': [0], 'offsets': [0], 'min': [], 'max': []}
+		self._done = 0
+		self._minmax = (None, None)
+		self._w = self._mk(mode)
+	def _current_minmax(self):
+		res = self._minmax
+		if self._w:
+			res = _minmax_merge(res, (self._w.min, self._w.max))
+		return res
+	@property
+	def min(self):
+		return self._current_minmax()[0]
+	@property
+	def max(self):
+		return self._current_minmax()[1]
+	def _finish_block(self):
+		w = self._w
+		self._done += w.count
+		self.index['min'].append(w.min)
+		self.index['max'].append(w.max)
+		self._minmax = self._current_minmax()
+		w.close()
+	def _new_block(self):
+		import os
+		self._finish_block()
+		self.index['rows'].append(self._done)
+		self.index['offsets'].append(os.path.getsize(self.fn))
+		self._w = self._mk(self._append_mode)
+	def write(self, v):
+		# Rotate before writing, so there is never an empty last block.
+		if self._w.count == self.block_rows:
+			self._new_block()
+		return self._w.write(v)
+	def hashcheck(self, v):
+		return self._w.hashcheck(v)
+	def hash(self, v):
+		return self._w.hash(v)
+	@property
+	def count(self):
+		return self._done + (self._w.count if self._w else 0)
+	def close(self):
+		if self._w:
+			self._finish_block()
+			self._w = None
+	def __enter__(self):
+		return self
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+class GzWriteGroup(object):
+	"""Several columns in one file, block_rows values at a time: each
+	block has a gzip member (or raw block) per column, one after the
+	other. Values are kept in memory until every column has a full block,
+	so the columns can be written row by row or one after the other (but
+	then the whole slice is kept in memory). .writer(name, wt, **kw) gives
+	the writer for a column, and .index has the block index for all of
+	them ({'rows': [...], 'offsets': {name: [...]}, 'min': {name: [...]},
+	'max': {name: [...]}}) when all the writers are closed. Call .flush()
+	when all columns are written to write the last (short) block before
+	looking at min/max. Invalid values fail when their block is written."""
+	def __init__(self, fn, block_rows, mode=None):
+		assert block_rows > 0, block_rows
+		mode = mode or 'w'
+		self._append_mode = 'a' + mode[1:]
+		self.fn = fn
+		self.block_rows = block_rows
+		self.index = {'rows': [], 'offsets': {}, 'min': {}, 'max': {}}
+		self._columns = []
+		self._open = 0
+		self._done = 0
+		# Readers need the file even if there are no blocks.
+		open(fn, 'wb').close()
+	def writer(self, name, wt, **kw):
+		assert name not in self.index['offsets'], "Duplicate column %s" % (name,)
+		w = _GzWriteGroupColumn(self, name, wt, kw)
+		self._columns.append(w)
+		self._open += 1
+		for k in ('offsets', 'min', 'max',):
+			self.index[k][name] = []
+		return w
+	def _block_full(self):
+		while all(len(c._values) >= self.block_rows for c in self._columns):
+			self._write_block(self.block_rows)
+	def flush(self):
+		"""Write what is left as a block (all columns must have the same
+		number of values left)"""
+		self._block_full()
+		left = set(len(c._values) for c in self._columns)
+		assert len(left) <= 1, "Not all columns in %s have the same number of values" % (self.fn,)
+		if left and left != {0}:
+			self._write_block(left.pop())
+	def _write_block(self, rows):
+		import os
+		from collections import deque
+		self.index['rows'].append(self._done)
+		self._done += rows
+		for c in self._columns:
+			self.index['offsets'][c.name].append(os.path.getsize(self.fn))
+			with c._wt(self.fn, mode=self._append_mode, **c._kw) as w:
+				deque(imap(w.write, c._values[:rows]), maxlen=0)
+				self.index['min'][c.name].append(w.min)
+				self.index['max'][c.name].append(w.max)
+			del c._values[:rows]
+	def _closed(self):
+		self._open -= 1
+		if not self._open:
+			self.flush()
+
+class _GzWriteGroupColumn(object):
+	# The values are kept until the block is full, and then written (and
+	# checked, and min/max kept) by the group. Hashing uses a writer to
+	# /dev/null that is never written to.
+	def __init__(self, group, name, wt, kw):
+		import os
+		self.group = group
+		self.name = name
+		self._wt = wt
+		self._kw = {k: v for k, v in kw.items() if k not in ('mode', 'hashfilter',)}
+		self._hasher = wt(os.devnull, **{k: v for k, v in kw.items() if k != 'mode'})
+		self._hashfilter = kw.get('hashfilter')
+		self._values = []
+		self._closed = False
+	def write(self, v):
+		if self._hashfilter and not self._hasher.hashcheck(v):
+			return False
+		self._values.append(v)
+		if len(self._values) % self.group.block_rows == 0:
+			self.group._block_full()
+		return True
+	@property
+	def count(self):
+		return self.group._done + len(self._values)
+	def _minmax(self):
+		res = (None, None)
+		index = self.group.index
+		for mm in izip(index['min'][self.name], index['max'][self.name]):
+			res = _minmax_merge(res, mm)
+		return res
+	@property
+	def min(self):
+		return self._minmax()[0]
+	@property
+	def max(self):
+		return self._minmax()[1]
+	def hashcheck(self, v):
+		return self._hasher.hashcheck(v)
+	def hash(self, v):
+		return self._hasher.hash(v)
+	def close(self):
+		if not self._closed:
+			self._closed = True
+			self._hasher.close()
+			self.group._closed()
+	def __enter__(self):
+		return self
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+def _bloom_positions(h, k, m):
+	h &= 0xffffffffffffffff
+	h1 = h >> 32
+	h2 = (h & 0xffffffff) | 1
+	return [(h1 + i * h2) % m for i in range(k)]
+
+def bloom_build(hashes, bits_per_value=10, k=7):
+	"""A Bloom filter for the (gzutil) hashes, about 1% false positives
+	with the defaults."""
+	m = max(64, len(hashes) * bits_per_value)
+	m = (m + 7) & ~7
+	bits = bytearray(m // 8)
+	for h in hashes:
+		for p in _bloom_positions(h, k, m):
+			bits[p >> 3] |= 1 << (p & 7)
+	return {'k': k, 'bits': bits}
+
+def bloom_check(bloom, h):
+	"""False if h is definitely not in the filter"""
+	bits = bloom['bits']
+	for p in _bloom_positions(h, bloom['k'], len(bits) * 8):
+		if not bits[p >> 3] & (1 << (p & 7)):
+			return False
+	return True
+
+class GzWriteBloom(object):
+	"""Wraps a typed writer, keeping the hash of every (non-None) value
+	written, so a Bloom filter can be built when closing. The filter
+	ends up in .bloom. This costs an extra python call per value written,
+	and memory for the hash of every distinct value in the slice."""
+	def __init__(self, w, default=None):
+		assert hasattr(w, 'hash'), "Can't build a Bloom filter without writer.hash"
+		self._w = w
+		self._default = default
+		self._hashes = set()
+		self.bloom = None
+	def write(self, v):
+		res = self._w.write(v)
+		# Writers with a hashfilter say False for values in other slices.
+		if res is not False and v is not None:
+			try:
+				self._hashes.add(self._w.hash(v))
+			except (TypeError, ValueError, OverflowError):
+				# Not a valid value, so the default was written.
+				if self._default is not None:
+					self._hashes.add(self._w.hash(self._default))
+		return res
+	def hashcheck(self, v):
+		return self._w.hashcheck(v)
+	def hash(self, v):
+		return self._w.hash(v)
+	def __getattr__(self, name):
+		# count, min, max, index (if blocked) and so on.
+		return getattr(self._w, name)
+	def close(self):
+		if self.bloom is None:
+			self._w.close()
+			self.bloom = bloom_build(self._hashes)
+			self._hashes = None
+	def __enter__(self):
+		return self
+	def __exit__(self, type, value, traceback):
+		self.close()
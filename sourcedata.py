@@ -23,7 +23,7 @@ import gzutil
 
 assert gzutil.version >= (2, 8, 1) and gzutil.version[0] == 2, gzutil.version
 
-from compat import PY3
+from compat import PY3, imap
 
 type2iter = {
 	'number'  : gzutil.GzNumber,
@@ -44,18 +44,22 @@ type2iter = {
 
 def _mklistreader(inner_type, seq_type):
 	from compat import builtins
+	from itertools import islice
 	reader = type2iter[inner_type.lower()]
 	mk = getattr(builtins, seq_type.lower())
 	class GzXList(object):
 		def __init__(self, *a, **kw):
-			if 'max_count' in kw:
-				kw['max_count'] += 1
+			# max_count is in lists, not in values.
+			self._left = kw.pop('max_count', -1)
 			self.fh = reader(*a, **kw)
 		def __next__(self):
+			if not self._left:
+				raise StopIteration()
+			self._left -= 1
 			llen = next(self.fh)
 			if llen is None:
 				return None
-			return mk(next(self.fh) for _ in range(int(llen)))
+			return mk(islice(self.fh, int(llen)))
 		next = __next__
 		def close(self):
 			self.fh.close()
@@ -72,11 +76,240 @@ for _seq_t in ('List', 'Set',):
 	for _t in ('Number', 'Ascii', 'Unicode',):
 		type2iter[(_t + _seq_t).lower()] = _mklistreader(_t, _seq_t)
 
+def _mkdictreader(inner_type):
+	try:
+		from sys import intern
+	except ImportError:
+		from __builtin__ import intern
+	class GzXDict(object):
+		"""Values are shared (and interned when possible), so a slice only
+		has one object per distinct value."""
+		def __init__(self, fn, hashfilter=None, codec=None, **kw):
+			from extras import pickle_load
+			self.fh = open_column(gzutil.GzInt32, fn, codec, **kw)
+			self._values = [intern(v) if type(v) is str else v for v in pickle_load(fn + '.dict')]
+			if hashfilter:
+				from gzwrite import typed_writer
+				import os
+				h = typed_writer(inner_type)(os.devnull).hash
+				sliceno, slices = hashfilter
+				self._values = [h(v) % slices == sliceno for v in self._values]
+		def __next__(self):
+			return self._values[next(self.fh)]
+		next = __next__
+		def close(self):
+			self.fh.close()
+		def __iter__(self):
+			return self
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzXDict.__name__ = 'Gz%sDict' % (inner_type.capitalize(),)
+	return GzXDict
+
+for _t in ('bytes', 'ascii', 'unicode',):
+	type2iter[_t + ':dict'] = _mkdictreader(_t)
+
+def _int2date(i):
+	from datetime import date
+	return date.fromordinal(i)
+
+def _int2datetime(i):
+	from datetime import datetime, timedelta
+	return datetime(1970, 1, 1) + timedelta(microseconds=i)
+
+def _mkdeltareader(inner_type, from_int):
+	from itertools import chain, count, islice, repeat
+	class GzXDelta(object):
+		"""Reads the (delta, run length) pairs from gzwrite._mkdeltawriter."""
+		def __init__(self, fn, max_count=-1, hashfilter=None, **kw):
+			self.fh = gzutil.GzNumber(fn, **kw)
+			it = chain.from_iterable(self._runs())
+			if max_count >= 0:
+				# The pairs don't say where the slice ends in merged files.
+				it = islice(it, max_count)
+			if hashfilter:
+				from gzwrite import typed_writer
+				import os
+				it = imap(typed_writer(inner_type)(os.devnull, hashfilter=hashfilter).hashcheck, it)
+			self._it = it
+		def _runs(self):
+			fh = self.fh
+			value = 0
+			for delta in fh:
+				run = next(fh)
+				if not run:
+					value = 0 # a new writer started here
+				elif delta is None:
+					yield repeat(None, run)
+				elif delta == 0:
+					yield repeat(from_int(value) if from_int else value, run)
+				else:
+					values = islice(count(value + delta, delta), run)
+					value += delta * run
+					yield imap(from_int, values) if from_int else values
+		def __next__(self):
+			return next(self._it)
+		next = __next__
+		def close(self):
+			self.fh.close()
+		def __iter__(self):
+			return self
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzXDelta.__name__ = 'Gz%sDelta' % (inner_type.capitalize(),)
+	return GzXDelta
+
+type2iter['int64:delta'] = _mkdeltareader('int64', None)
+type2iter['int32:delta'] = _mkdeltareader('int32', None)
+type2iter['date:delta'] = _mkdeltareader('date', _int2date)
+type2iter['datetime:delta'] = _mkdeltareader('datetime', _int2datetime)
+
+def _heap_chunks(fn, codec):
+	"""The (decompressed) contents of fn in pieces, or all of it mmaped
+	if it is not compressed."""
+	import os
+	if not os.path.getsize(fn):
+		return
+	if codec == 'raw':
+		from mmap import mmap, ACCESS_READ
+		with open(fn, 'rb') as fh:
+			yield mmap(fh.fileno(), 0, access=ACCESS_READ)
+	else:
+		for data in _decompressed_chunks(fn, codec, 0, None, 1048576):
+			yield bytes(data)
+
+def _whole_file(fn, codec):
+	"""The (decompressed) contents of fn, mmaped if it is not compressed"""
+	if codec == 'raw':
+		return next(_heap_chunks(fn, codec), b'')
+	return b''.join(_heap_chunks(fn, codec))
+
+def heap_arrays(fn, count, codec):
+	"""(offsets, heap, nulls) for a heap string column file, see
+	Dataset.column_heap."""
+	import numpy as np
+	ends = list(array_reader('int64', fn + '.offsets', 0, count, max(count, 1), codec))
+	ends = np.concatenate(ends) if ends else np.zeros(0, dtype='i8')
+	nulls = (ends == -0x8000000000000000)
+	# None values are empty (end where the previous value ended).
+	ends = np.maximum.accumulate(np.where(nulls, 0, ends)) if count else ends
+	offsets = np.concatenate([np.zeros(1, dtype='i8'), ends])
+	return offsets, _whole_file(fn, codec), nulls
+
+def list_arrays(typename, fn, count, codec):
+	"""(offsets, values, nulls) for a flat list column file, see
+	Dataset.column_lists."""
+	import numpy as np
+	inner_type = typename.split(':', 1)[1]
+	lengths = list(array_reader('int32', fn, 0, count, max(count, 1), codec))
+	lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype='i4')
+	nulls = (lengths == -0x80000000)
+	offsets = np.zeros(count + 1, dtype='i8')
+	np.cumsum(np.where(nulls, 0, lengths), out=offsets[1:])
+	values = list(array_reader(inner_type, fn + '.values', 0, int(offsets[-1]), max(int(offsets[-1]), 1), codec))
+	if len(values) == 1:
+		values = values[0]
+	elif values:
+		values = np.concatenate(values)
+	else:
+		values = type2array[inner_type][1](np, b'')
+	return offsets, values, nulls
+
+def _mkheapreader(inner_type, encoding):
+	class GzXHeap(object):
+		"""Reads the values from gzwrite._mkheapwriter, without any scanning."""
+		def __init__(self, fn, hashfilter=None, max_count=-1, seek=0, codec=None):
+			assert not seek, "Heap string columns can't seek"
+			self.fh = open_column(gzutil.GzInt64, fn + '.offsets', codec, max_count=max_count)
+			self._chunks = _heap_chunks(fn, codec)
+			it = self._values()
+			if hashfilter:
+				from gzwrite import typed_writer
+				import os
+				it = imap(typed_writer(inner_type)(os.devnull, hashfilter=hashfilter).hashcheck, it)
+			self._it = it
+		def _values(self):
+			# Only a piece of the heap at a time (unless it's mmaped).
+			buf = b''
+			pos = 0 # where buf starts in the heap
+			start = 0
+			for end in self.fh:
+				if end is None:
+					yield None
+					continue
+				while end > pos + len(buf):
+					data = next(self._chunks, None)
+					if data is None:
+						raise IOError("Heap ended early")
+					rest = buf[start - pos:]
+					buf = rest + data if rest else data
+					pos = start
+				if encoding:
+					yield buf[start - pos:end - pos].decode(encoding)
+				else:
+					yield buf[start - pos:end - pos]
+				start = end
+		def __next__(self):
+			return next(self._it)
+		next = __next__
+		def close(self):
+			self.fh.close()
+			self._chunks.close()
+		def __iter__(self):
+			return self
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzXHeap.__name__ = 'Gz%sHeap' % (inner_type.capitalize(),)
+	return GzXHeap
+
+type2iter['bytes:heap'] = _mkheapreader('bytes', None)
+type2iter['ascii:heap'] = _mkheapreader('ascii', 'ascii' if PY3 else None)
+type2iter['unicode:heap'] = _mkheapreader('unicode', 'utf-8')
+
+def _mkflatlistreader(inner_type, seq_type):
+	from compat import builtins
+	from itertools import islice
+	reader = type2iter[inner_type]
+	mk = getattr(builtins, seq_type)
+	class GzFlatXList(object):
+		"""Reads the lengths and values from gzwrite._mkflatlistwriter."""
+		def __init__(self, fn, max_count=-1, hashfilter=None, seek=0, codec=None):
+			assert not hashfilter, "%s:%s can't be the hashlabel" % (seq_type, inner_type,)
+			assert not seek, "Flat list columns can't seek"
+			self.fh = open_column(gzutil.GzInt32, fn, codec, max_count=max_count)
+			self._values = open_column(reader, fn + '.values', codec)
+		def __next__(self):
+			llen = next(self.fh)
+			if llen is None:
+				return None
+			return mk(islice(self._values, llen))
+		next = __next__
+		def close(self):
+			self.fh.close()
+			self._values.close()
+		def __iter__(self):
+			return self
+		def __enter__(self):
+			return self
+		def __exit__(self, type, value, traceback):
+			self.close()
+	GzFlatXList.__name__ = 'Gz%s%s' % (seq_type.capitalize(), inner_type.capitalize(),)
+	return GzFlatXList
+
+for _seq_t in ('list', 'set',):
+	# same as gzwrite.flat_list_inner_types
+	for _t in ('number', 'int64', 'int32', 'float64', 'float32', 'bool', 'datetime', 'date', 'time', 'bytes', 'ascii', 'unicode',):
+		type2iter[_seq_t + ':' + _t] = _mkflatlistreader(_t, _seq_t)
+
 from ujson import loads
 class GzJson(object):
 	def __init__(self, *a, **kw):
-		if 'max_count' in kw:
-			kw['max_count'] += 1
 		if PY3:
 			self.fh = gzutil.GzUnicodeLines(*a, **kw)
 		else:
@@ -94,7 +327,239 @@ class GzJson(object):
 		self.close()
 type2iter['json'] = GzJson
 
+class GzPickle(object):
+	"""Reads the pickles from gzwrite.GzWritePickle."""
+	def __init__(self, fn, seek=0, max_count=-1):
+		import io
+		from compat import pickle
+		self._raw_fh = fh = io.open(fn, 'rb')
+		if seek:
+			fh.seek(seek)
+		if fh.peek(3)[:3] == b'\x1f\x8b\x08':
+			import gzip
+			fh = gzip.GzipFile(fileobj=fh, mode='rb')
+		self.fh = fh
+		if PY3:
+			# like extras.pickle_load, for pickles from python2.
+			self._load = pickle.Unpickler(fh, encoding='bytes').load
+		else:
+			self._load = pickle.Unpickler(fh).load
+		self._left = max_count
+	def __next__(self):
+		if not self._left:
+			raise StopIteration()
+		try:
+			o = self._load()
+		except EOFError:
+			raise StopIteration()
+		self._left -= 1
+		return o
+	next = __next__
+	def close(self):
+		self.fh.close()
+		self._raw_fh.close()
+	def __iter__(self):
+		return self
+	def __enter__(self):
+		return self
+	def __exit__(self, type, value, traceback):
+		self.close()
+type2iter['pickle'] = GzPickle
+
 def typed_reader(typename):
 	if typename not in type2iter:
 		raise ValueError("Unknown reader for type %s" % (typename,))
 	return type2iter[typename]
+
+
+# Fixed width types can be decoded straight into numpy arrays.
+# The on-disk format is the native C representation of each value (see
+# default_analysis/dataset_typing.py), with these None-markers:
+#     float64/float32 are special NaNs (so they come out as NaN),
+#     int64/int32 are the smallest value of the type (left as is),
+#     bool is 255 (becomes False),
+#     date/datetime/time are 0 (become NaT).
+
+def _ymd2datetime64(np, year, month, day):
+	res = (year.astype('i8') - 1970).astype('M8[Y]').astype('M8[M]')
+	res = (res + (month.astype('i8') - 1).astype('m8[M]')).astype('M8[D]')
+	return res + (day.astype('i8') - 1).astype('m8[D]')
+
+def _hms2us(np, i0, i1):
+	hms = (i0 & 31).astype('i8') * 3600 + (i1 >> 26).astype('i8') * 60 + ((i1 >> 20) & 63)
+	return hms * 1000000 + (i1 & 0xfffff)
+
+def _decode_date(np, data):
+	a = np.frombuffer(data, dtype='u4')
+	res = _ymd2datetime64(np, a >> 9, (a >> 5) & 15, a & 31)
+	res[a == 0] = np.datetime64('NaT')
+	return res
+
+def _decode_datetime(np, data):
+	a = np.frombuffer(data, dtype='u4').reshape(-1, 2)
+	i0, i1 = a[:, 0], a[:, 1]
+	res = _ymd2datetime64(np, i0 >> 14, (i0 >> 10) & 15, (i0 >> 5) & 31).astype('M8[us]')
+	res += _hms2us(np, i0, i1).astype('m8[us]')
+	res[i0 == 0] = np.datetime64('NaT')
+	return res
+
+def _decode_time(np, data):
+	a = np.frombuffer(data, dtype='u4').reshape(-1, 2)
+	i0, i1 = a[:, 0], a[:, 1]
+	res = _hms2us(np, i0, i1).astype('m8[us]')
+	res[i0 == 0] = np.timedelta64('NaT')
+	return res
+
+def _decode_bool(np, data):
+	return np.frombuffer(data, dtype='u1') == 1
+
+def _mkdecoder(dtype):
+	def decode(np, data):
+		return np.frombuffer(data, dtype=dtype)
+	return decode
+
+# {type: (bytes per value, decode(numpy, data) -> array)}
+type2array = {
+	'float64' : (8, _mkdecoder('f8')),
+	'float32' : (4, _mkdecoder('f4')),
+	'int64'   : (8, _mkdecoder('i8')),
+	'int32'   : (4, _mkdecoder('i4')),
+	'bits64'  : (8, _mkdecoder('u8')),
+	'bits32'  : (4, _mkdecoder('u4')),
+	'bool'    : (1, _decode_bool),
+	'datetime': (8, _decode_datetime),
+	'date'    : (4, _decode_date),
+	'time'    : (8, _decode_time),
+	# the codes, see Dataset.column_dictionary
+	'bytes:dict'  : (4, _mkdecoder('i4')),
+	'ascii:dict'  : (4, _mkdecoder('i4')),
+	'unicode:dict': (4, _mkdecoder('i4')),
+}
+
+def _decompressor(codec):
+	if codec in (None, 'gzip',):
+		from zlib import decompressobj, MAX_WBITS
+		return decompressobj(16 + MAX_WBITS)
+	elif codec == 'bz2':
+		from bz2 import BZ2Decompressor
+		return BZ2Decompressor()
+	elif codec == 'lzma':
+		try:
+			from lzma import LZMADecompressor
+		except ImportError:
+			raise ImportError("lzma compressed columns need the lzma module (python 3)")
+		return LZMADecompressor()
+	else:
+		raise ValueError("Can't decompress codec %s" % (codec,))
+
+def _decompressed_chunks(fn, codec, seek, size, chunk_size):
+	"""Yields the decompressed contents of fn (starting at byte offset
+	seek) in pieces of chunk_size bytes, until size bytes are read (or
+	until the end if size is None). Handles concatenated streams."""
+	is_zlib = codec in (None, 'gzip',)
+	with open(fn, 'rb') as fh:
+		fh.seek(seek)
+		z = _decompressor(codec)
+		buf = bytearray()
+		eof = False
+		while size is None or size > 0:
+			want = chunk_size if size is None else min(chunk_size, size)
+			while len(buf) < want:
+				if is_zlib and z.unconsumed_tail:
+					data = z.unconsumed_tail
+				elif z.unused_data: # next stream
+					data = z.unused_data
+					z = _decompressor(codec)
+				else:
+					data = fh.read(1048576 if is_zlib else 65536)
+					if not data:
+						eof = True
+						break
+				if is_zlib:
+					buf += z.decompress(data, want - len(buf))
+				else:
+					buf += z.decompress(data)
+			if eof:
+				if size is not None and len(buf) < size:
+					raise IOError("%s: File ended %d bytes early" % (fn, size - len(buf),))
+				want = len(buf)
+				if not want:
+					return
+			yield buf[:want]
+			del buf[:want]
+			if size is not None:
+				size -= want
+
+def _mmap_chunks(fn, seek, size, chunk_size):
+	"""Like _decompressed_chunks for uncompressed files, but gives
+	zero copy uint8 arrays."""
+	if not size:
+		return
+	import numpy as np
+	from mmap import mmap, ACCESS_READ
+	with open(fn, 'rb') as fh:
+		m = mmap(fh.fileno(), 0, access=ACCESS_READ)
+	end = seek + size
+	if len(m) < end:
+		raise IOError("%s: File ended %d bytes early" % (fn, end - len(m),))
+	for pos in range(seek, end, chunk_size):
+		yield np.frombuffer(m, dtype='u1', count=min(chunk_size, end - pos), offset=pos)
+
+def array_reader(typename, fn, seek=0, count=0, chunk_rows=1048576, codec=None):
+	"""Yields numpy arrays of (up to) chunk_rows values each from fn,
+	count values in total. The arrays may be read-only."""
+	import numpy as np
+	if typename not in type2array:
+		raise ValueError("No array reader for type %s" % (typename,))
+	itemsize, decode = type2array[typename]
+	if codec == 'raw':
+		chunks = _mmap_chunks(fn, seek, count * itemsize, chunk_rows * itemsize)
+	else:
+		chunks = _decompressed_chunks(fn, codec, seek, count * itemsize, chunk_rows * itemsize)
+	for data in chunks:
+		yield decode(np, data)
+
+def _file_chunks(fn, seek):
+	with open(fn, 'rb') as fh:
+		fh.seek(seek)
+		while True:
+			data = fh.read(1048576)
+			if not data:
+				return
+			yield data
+
+def _gzip_wrapped(chunks):
+	"""chunks as an uncompressed gzip stream"""
+	from zlib import compressobj, DEFLATED, MAX_WBITS
+	z = compressobj(0, DEFLATED, 16 + MAX_WBITS)
+	for data in chunks:
+		yield z.compress(bytes(data))
+	yield z.flush()
+
+def _starts_like_gzip(fn, seek):
+	with open(fn, 'rb') as fh:
+		fh.seek(seek)
+		return fh.read(2) == b'\x1f\x8b'
+
+def open_column(mkiter, fn, codec=None, seek=0, **kw):
+	"""mkiter(fn, seek=seek, **kw) for a column file compressed with codec.
+	Codecs the gzutil readers can't handle are decompressed to a
+	temporary file first (the whole slice, gzutil can't read from a
+	pipe). Raw files where the data (at seek) starts with the gzip magic
+	are copied too, as gzutil would take them for gzip files. The copy
+	is an uncompressed gzip stream, so there is no guessing."""
+	if codec in ('bz2', 'lzma',):
+		chunks = _decompressed_chunks(fn, codec, seek, None, 1048576)
+	elif codec == 'raw' and _starts_like_gzip(fn, seek):
+		chunks = _file_chunks(fn, seek)
+	else:
+		if seek:
+			kw['seek'] = seek
+		return mkiter(fn, **kw)
+	from tempfile import TemporaryFile
+	with TemporaryFile() as fh:
+		for data in _gzip_wrapped(chunks):
+			fh.write(data)
+		fh.flush()
+		# The reader opens its own fd, which keeps the (unlinked) file.
+		return mkiter('/dev/fd/%d' % (fh.fileno(),), **kw)
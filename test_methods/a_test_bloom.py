@@ -0,0 +1,72 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+
+description = r'''
+Write datasets with Bloom filters and check that filtered iteration
+finds all matching rows, and that slices without a value are skipped.
+'''
+
+from datetime import date
+
+from dataset import DatasetWriter
+
+values = {
+	'int64'  : lambda ix: ix * 3,
+	'bool'   : lambda ix: ix % 2 == 1,
+	'bytes'  : lambda ix: b'k%d' % (ix,),
+	'unicode': lambda ix: u'\xe5%d' % (ix,),
+	'date'   : lambda ix: date.fromordinal(730000 + ix),
+	'number' : lambda ix: ix / 2,
+}
+
+def synthesis(params):
+	# Types without a hash can't have a filter.
+	for t in ('json', 'pickle', 'list:int64',):
+		try:
+			DatasetWriter(name=t.replace(':', '_'), columns={'a': t}, bloom=['a'])
+		except AssertionError:
+			pass
+		else:
+			raise Exception('Bloom filter on %s column allowed' % (t,))
+
+	# One row per slice, so a value is in one slice (except bool), and the
+	# filter must never rule out that slice.
+	cols = {t.replace(':', '_'): t for t in values}
+	dw = DatasetWriter(columns=cols, bloom=list(cols))
+	for sliceno in range(params.slices):
+		dw.set_slice(sliceno)
+		dw.write_dict({n: values[t](sliceno) for n, t in cols.items()})
+	ds = dw.finish()
+	for n, t in sorted(cols.items()):
+		for sliceno in range(params.slices):
+			v = values[t](sliceno)
+			got = list(ds.iterate(None, [n], filters={n: set([v]).__contains__}))
+			want = [(v,)] * sum(values[t](ix) == v for ix in range(params.slices))
+			assert got == want, '%s: %r != %r' % (t, got, want,)
+			if t == 'bool':
+				continue
+			for other in range(params.slices):
+				may = ds._bloom_may_contain(other, {n: [v]})
+				assert may or other != sliceno, '%s: slice %d ruled out for its own value' % (t, sliceno,)
+		missing = values[t](params.slices + 1000)
+		if t != 'bool':
+			assert list(ds.iterate(None, [n], filters={n: ('eq', missing)})) == [], t
+		print(t, 'ok')
@@ -0,0 +1,98 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+
+description = r'''
+Write every column type with every codec and read it back.
+
+The first bytes value in slice 0 starts with the gzip magic, which the
+readers must not take for a gzip header in raw (or decompressed) files.
+'''
+
+from datetime import datetime, date, time
+
+from compat import PY3
+from dataset import DatasetWriter
+from gzwrite import sidecar_type, dict_type
+
+MAGIC = b'\x1f\x8b\x08 not gzip'
+
+values = {
+	'number'        : [1, 2.5, -3, 1 << 40],
+	'float64'       : [0.5, -1.25, 3.0, 1e300],
+	'float32'       : [0.5, -1.25, 3.0, 1024.0],
+	'int64'         : [0, -1, 1 << 62, -(1 << 62)],
+	'int32'         : [0, -1, 1 << 30, -(1 << 30)],
+	'bits64'        : [0, 1, 1 << 63, (1 << 64) - 1],
+	'bits32'        : [0, 1, 1 << 31, (1 << 32) - 1],
+	'bool'          : [True, False, False, True],
+	'datetime'      : [datetime(2017, 1, 2, 3, 4, 5, 6), datetime(1970, 1, 1), datetime(1999, 12, 31, 23, 59, 59), datetime(2038, 1, 19)],
+	'date'          : [date(2017, 1, 2), date(1970, 1, 1), date(1, 1, 1), date(9999, 12, 31)],
+	'time'          : [time(0, 0), time(23, 59, 59, 999999), time(12), time(1, 2, 3)],
+	'bytes'         : [MAGIC, b'', b'a\tb', b'\xff'],
+	'ascii'         : ['a', '', 'b c', 'd'],
+	'unicode'       : [u'\xe5', u'', u'a', u'\u20ac'],
+	'json'          : [{'a': [1, 2]}, [], None, 'x'],
+	'pickle'        : [MAGIC, (1, b'x'), datetime(2017, 1, 1), {1: set([2])}],
+	'ascii:dict'    : ['a', 'b', 'a', 'c'],
+	'bytes:dict'    : [MAGIC, b'b', MAGIC, b''],
+	'unicode:dict'  : [u'\xe5', u'\xe5', u'a', u''],
+	'int64:delta'   : [1, 2, 3, 100],
+	'int32:delta'   : [5, 5, 5, -5],
+	'date:delta'    : [date(2017, 1, 1), date(2017, 1, 2), date(2016, 1, 1), date(2016, 1, 1)],
+	'datetime:delta': [datetime(2017, 1, 1), datetime(2017, 1, 1, 0, 0, 1), datetime(2017, 1, 1), datetime(1970, 1, 1)],
+	'bytes:heap'    : [MAGIC, b'', b'a\nb', b'\0'],
+	'ascii:heap'    : ['a', '', 'b\nc', 'd'],
+	'unicode:heap'  : [u'\xe5', u'', u'a\nb', u'\u20ac'],
+	'list:int64'    : [[1, 2], [], [-3], [1 << 40]],
+	'list:bytes'    : [[MAGIC], [], [b'a', b''], [b'\0x']],
+	'list:date'     : [[date(2017, 1, 1)], [], [], [date(1970, 1, 1), date(1970, 1, 1)]],
+	'set:unicode'   : [set([u'a', u'\xe5']), set(), set([u'']), set([u'b'])],
+	'set:float64'   : [set([0.5]), set(), set([1.0, 2.0]), set([-1.0])],
+}
+
+def codecs():
+	res = ['gzip', 'gzip:1', 'raw', 'bz2']
+	if PY3:
+		res.append('lzma')
+	return res
+
+def columns(codec):
+	return {
+		t.replace(':', '_'): t
+		for t in values
+		if codec.split(':')[0] in ('gzip', 'raw',) or not (sidecar_type(t) or dict_type(t))
+	}
+
+def synthesis(params):
+	for codec in codecs():
+		cols = columns(codec)
+		dw = DatasetWriter(name=codec.replace(':', ''), columns=cols, compression=codec)
+		for sliceno in range(params.slices):
+			dw.set_slice(sliceno)
+			for ix in range(4):
+				dw.write_dict({n: values[t][(ix + sliceno) % 4] for n, t in cols.items()})
+		ds = dw.finish()
+		for sliceno in range(params.slices):
+			for n, t in sorted(cols.items()):
+				want = [values[t][(ix + sliceno) % 4] for ix in range(4)]
+				got = list(ds.iterate(sliceno, n))
+				assert got == want, '%s %s slice %d: %r != %r' % (codec, t, sliceno, got, want,)
+		print(codec, 'ok:', ', '.join(sorted(cols.values())))
@@ -0,0 +1,113 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+
+description = r'''
+Import the same lines with csvimport in the different modes (every slice
+reading, single_read of plain and gzip files, several files, as_chain,
+with and without hashlabel and column2type) and check what comes out.
+'''
+
+import os
+import gzip
+from datetime import date
+
+import subjobs
+from dataset import Dataset
+from gzwrite import typed_writer
+
+column2type = {'id': 'int64_10', 'num': 'int32_10', 'when': 'date:%Y-%m-%d'}
+
+def line(ix):
+	num = 'x' if ix % 97 == 0 else str(ix % 1000 - 500) # x gets the default
+	when = date.fromordinal(730000 + ix % 3000).strftime('%Y-%m-%d')
+	return '%d,k%d,%s,%s\n' % (ix, ix % 41, num, when,)
+
+def expected(ixes, typed):
+	res = []
+	for ix in ixes:
+		id, key, num, when = line(ix).rstrip('\n').split(',')
+		if typed:
+			id = int(id)
+			num = -1 if num == 'x' else int(num)
+			when = date(*map(int, when.split('-')))
+		res.append((id, key, num, when,))
+	return sorted(res)
+
+def write(filename, ixes, opener=open):
+	with opener(filename, 'wb') as fh:
+		fh.write(b'id,key,num,when\n')
+		for ix in ixes:
+			fh.write(line(ix).encode('ascii'))
+	return os.path.abspath(filename)
+
+def check(jid, ixes, hashlabel, typed, name='default'):
+	ds = Dataset((jid, name))
+	cols = ['id', 'key', 'num', 'when']
+	want = expected(ixes, typed)
+	got = sorted(ds.iterate(None, cols))
+	assert got == want, '%s: %d lines, wanted %d' % (ds, len(got), len(want),)
+	assert sum(ds.lines) == len(want), ds
+	if hashlabel:
+		slices = len(ds.lines)
+		h = typed_writer('bytes')(os.devnull).hash
+		for sliceno in range(slices):
+			for v in ds.iterate(sliceno, hashlabel):
+				assert h(v) % slices == sliceno, '%s: %r in slice %d' % (ds, v, sliceno,)
+	if typed:
+		for ix, n in enumerate(cols):
+			if n in column2type:
+				dc = ds.columns[n]
+				values = [t[ix] for t in want]
+				assert (dc.min, dc.max) == (min(values), max(values)), '%s: %s minmax %r' % (ds, n, (dc.min, dc.max),)
+
+def imp(**options):
+	return subjobs.build('csvimport', options=options)
+
+def synthesis(params):
+	small = range(5000)
+	plain = write('plain.csv', small)
+	# More than a few index points (GZ_INDEX_SPAN) worth of lines.
+	big = range(300000)
+	big_gz = write('big.csv.gz', big, gzip.open)
+	parts = [range(ix, 6000, 3) for ix in range(3)]
+	part_fns = [write('part%d.csv' % (ix,), ixes) for ix, ixes in enumerate(parts)]
+
+	for typed in (False, True):
+		c2t = column2type if typed else {}
+		kw = dict(column2type=c2t, defaults={'num': '-1'} if typed else {})
+		check(imp(filename=plain, **kw), small, None, typed)
+		for hashlabel in (None, 'key',):
+			check(imp(filename=plain, hashlabel=hashlabel, single_read=True, **kw), small, hashlabel, typed)
+			check(imp(filename=big_gz, hashlabel=hashlabel, single_read=True, **kw), big, hashlabel, typed)
+			check(imp(filename=os.path.join(os.path.dirname(plain), 'part*.csv'), hashlabel=hashlabel, **kw), sum(parts, []), hashlabel, typed)
+		jid = imp(filename=part_fns[0], filenames=part_fns[1:], as_chain=True, hashlabel='key', **kw)
+		assert len(Dataset(jid).chain()) == len(parts)
+		for ix, ixes in enumerate(parts[:-1]):
+			check(jid, ixes, 'key', typed, str(ix))
+		check(jid, parts[-1], 'key', typed)
+		print('typed' if typed else 'untyped', 'ok')
+
+	assert not os.path.exists(big_gz + '.gzidx'), 'gzip index cached without gz_index_cache'
+	check(imp(filename=big_gz, single_read=True, gz_index_cache=True), big, None, False)
+	assert os.path.exists(big_gz + '.gzidx')
+	# Again with the cached index (a different option, so not the same job).
+	check(imp(filename=big_gz, single_read=True, gz_index_cache=True, hashlabel='key'), big, 'key', False)
+	print('gz_index_cache ok')
@@ -0,0 +1,74 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+
+description = r'''
+Write a dataset with defer_compression, read it back, compress it like
+the daemon does and read it back again. Checks the sidecar files (heap
+offsets, list values) too.
+'''
+
+import os
+
+from dataset import DatasetWriter, compress_deferred
+from gzwrite import column_files
+
+values = {
+	'int64'       : lambda ix: ix,
+	'unicode'     : lambda ix: u'\xe5 %d' % (ix,),
+	'bytes:heap'  : lambda ix: b'\x1f\x8b %d\n' % (ix,),
+	'unicode:heap': lambda ix: u'%d\n\xe5' % (ix,),
+	'ascii:dict'  : lambda ix: 'v%d' % (ix % 3,),
+	'list:int32'  : lambda ix: list(range(ix % 5)),
+	'set:bytes'   : lambda ix: set([b'a', b'%d' % (ix % 4,)]),
+}
+
+def check(ds, cols, slices):
+	for sliceno in range(slices):
+		for n, t in sorted(cols.items()):
+			want = [values[t](ix) for ix in range(sliceno * 1000, sliceno * 1000 + 1000)]
+			got = list(ds.iterate(sliceno, n))
+			assert got == want, '%s slice %d' % (t, sliceno,)
+
+def files(ds, cols, slices):
+	res = set()
+	for n, t in cols.items():
+		for sliceno in range(slices):
+			res.update(column_files(t, ds.column_filename(n, sliceno)))
+	return res
+
+def synthesis(params):
+	cols = {t.replace(':', '_'): t for t in values}
+	dw = DatasetWriter(columns=cols, defer_compression=True)
+	for sliceno in range(params.slices):
+		dw.set_slice(sliceno)
+		for ix in range(sliceno * 1000, sliceno * 1000 + 1000):
+			dw.write_dict({n: values[t](ix) for n, t in cols.items()})
+	ds = dw.finish()
+	check(ds, cols, params.slices)
+	sizes = {fn: os.path.getsize(fn) for fn in files(ds, cols, params.slices)}
+	assert any(fn.endswith('.offsets') for fn in sizes) and any(fn.endswith('.values') for fn in sizes)
+	compress_deferred(os.getcwd())
+	for fn, size in sorted(sizes.items()):
+		with open(fn, 'rb') as fh:
+			assert fh.read(2) == b'\x1f\x8b', fn
+		assert os.path.getsize(fn) < size, '%s not compressed' % (fn,)
+	check(ds, cols, params.slices)
+	print('ok:', ', '.join(sorted(cols.values())))
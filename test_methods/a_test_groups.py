@@ -0,0 +1,93 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+
+description = r'''
+Write datasets with column_groups in the different ways (write_dict,
+write_columns, split_write_columns and the split writers) and read the
+columns back, whole, from a row and with take.
+'''
+
+from datetime import date
+
+from dataset import DatasetWriter
+
+columns = {
+	'num' : 'int64',
+	'text': 'unicode',
+	'day' : 'date',
+	'frac': 'float64',
+	'raw' : 'bytes',
+}
+groups = [['num', 'text', 'day'], ['frac']]
+order = sorted(columns) # the order write_columns and the split writers take
+block_rows = 100
+
+def row(ix):
+	return (date.fromordinal(730000 + ix % 1000), ix / 4, ix, b'%d' % (ix,), u'\xe5%d' % (ix,),)
+
+def rows(sliceno):
+	# Different lengths, none a multiple of block_rows.
+	return [row(sliceno * 10000 + ix) for ix in range(250 + 77 * sliceno)]
+
+def check(ds, slices, want):
+	for sliceno in range(slices):
+		got = list(ds.iterate(sliceno, order))
+		assert got == want[sliceno], '%s slice %d' % (ds, sliceno,)
+		assert list(ds.iterate(sliceno, order, start_row=123)) == want[sliceno][123:], '%s slice %d start_row' % (ds, sliceno,)
+		assert ds.take(sliceno, [201, 5, 150], order) == [want[sliceno][ix] for ix in (201, 5, 150)], '%s slice %d take' % (ds, sliceno,)
+		for ix, n in enumerate(order):
+			assert list(ds.iterate(sliceno, n)) == [r[ix] for r in want[sliceno]], '%s slice %d column %s' % (ds, sliceno, n,)
+
+def mkdw(name):
+	return DatasetWriter(name=name, columns=columns, column_groups=groups, block_rows=block_rows)
+
+def synthesis(params):
+	want = [rows(sliceno) for sliceno in range(params.slices)]
+
+	dw = mkdw('write_dict')
+	for sliceno in range(params.slices):
+		dw.set_slice(sliceno)
+		for r in want[sliceno]:
+			dw.write_dict(dict(zip(order, r)))
+	check(dw.finish(), params.slices, want)
+
+	# One column at a time, so the group blocks are cut when the last
+	# column catches up.
+	dw = mkdw('write_columns')
+	for sliceno in range(params.slices):
+		dw.set_slice(sliceno)
+		dw.write_columns(*zip(*want[sliceno]))
+	check(dw.finish(), params.slices, want)
+
+	# Round robin, so the slices get every params.slices:th row.
+	everything = [row(ix) for ix in range(1000)]
+	split = [everything[sliceno::params.slices] for sliceno in range(params.slices)]
+
+	dw = mkdw('split_write')
+	w = dw.get_split_write()
+	for r in everything:
+		w(*r)
+	check(dw.finish(), params.slices, split)
+
+	dw = mkdw('split_write_columns')
+	dw.split_write_columns(*zip(*everything))
+	check(dw.finish(), params.slices, split)
+	print('ok')
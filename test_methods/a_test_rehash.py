@@ -0,0 +1,79 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+from __future__ import division
+from __future__ import print_function
+
+description = r'''
+Rehash datasets with dataset_rehash, with only plain columns (merged to
+one dataset) and with each kind of column that has to be kept as a chain.
+'''
+
+import os
+from datetime import date
+
+import subjobs
+from dataset import Dataset, DatasetWriter
+from gzwrite import typed_writer
+
+values = {
+	'int64'       : lambda ix: ix,
+	'unicode'     : lambda ix: u'\xe5 %d' % (ix,),
+	'ascii:dict'  : lambda ix: 'v%d' % (ix % 3,),
+	'list:int32'  : lambda ix: list(range(ix % 5)),
+	'set:bytes'   : lambda ix: set([b'a', b'%d' % (ix % 4,)]),
+	'bytes:heap'  : lambda ix: b'\x1f\x8b %d\n' % (ix,),
+	'unicode:heap': lambda ix: u'%d\n\xe5' % (ix,),
+	'int64:delta' : lambda ix: ix * 3 - 1000,
+	'date:delta'  : lambda ix: date.fromordinal(730000 + ix),
+}
+
+def rows(cols, sliceno):
+	order = sorted(cols)
+	return [tuple(values[cols[n]](ix) for n in order) for ix in range(sliceno * 1000, sliceno * 1000 + 200 + 37 * sliceno)]
+
+def rehash(name, cols, slices):
+	cols = dict(cols, key='int64')
+	dw = DatasetWriter(name=name, columns=cols)
+	for sliceno in range(slices):
+		dw.set_slice(sliceno)
+		for r in rows(cols, sliceno):
+			dw.write(*r)
+	source = dw.finish()
+	jid = subjobs.build('dataset_rehash', options=dict(hashlabel='key'), datasets=dict(source=source))
+	ds = Dataset(jid)
+	key_ix = sorted(cols).index('key')
+	want = {}
+	for sliceno in range(slices):
+		want.update((r[key_ix], r) for r in rows(cols, sliceno))
+	got = {}
+	for sliceno in range(slices):
+		hashcheck = typed_writer('int64')(os.devnull, hashfilter=(sliceno, slices)).hashcheck
+		for r in ds.iterate_chain(sliceno, sorted(cols)):
+			assert hashcheck(r[key_ix]), '%s: %r in slice %d' % (name, r, sliceno,)
+			assert r[key_ix] not in got, '%s: %r twice' % (name, r,)
+			got[r[key_ix]] = r
+	assert got == want, name
+	return len(ds.chain())
+
+def synthesis(params):
+	plain = {t.replace(':', '_'): t for t in ('int64', 'unicode',)}
+	assert rehash('plain', plain, params.slices) == 1
+	for t in values:
+		if t not in ('int64', 'unicode',):
+			assert rehash(t.replace(':', '_'), {'col': t}, params.slices) == params.slices, t
+	print('ok')
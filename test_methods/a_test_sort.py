@@ -0,0 +1,71 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+from __future__ import division
+from __future__ import print_function
+
+description = r'''
+Sort datasets with dataset_sort and check that the rows come out in the
+same order as sorting the values as python objects (stable, None first).
+'''
+
+from datetime import date
+
+import subjobs
+from dataset import Dataset, DatasetWriter
+
+columns = {
+	'day' : 'date',
+	'flag': 'bool',
+	'frac': 'float64',
+	'ix'  : 'int64',
+	'word': 'ascii:dict',
+}
+order = sorted(columns)
+# Not in code order, the first one written gets the lowest code.
+words = ['pear', 'apple', None, 'fig', 'banana', 'apple']
+fracs = [2.5, None, -1.0, 0.0, float('-inf'), None, 7.25]
+flags = [True, None, False]
+days = [date(2018, 3, 1), None, date(1999, 12, 31), date(2018, 2, 28)]
+
+def row(ix):
+	return (days[ix % len(days)], flags[ix % len(flags)], fracs[ix % len(fracs)], ix, words[ix * 7 % len(words)],)
+
+def sort_key(colname):
+	ix = order.index(colname)
+	if colname == 'day':
+		# dataset_sort sorts temporal types as strings.
+		return lambda r: str(r[ix])
+	def key(r):
+		return (r[ix] is not None, r[ix],)
+	return key
+
+def synthesis(params):
+	want = [[row(sliceno * 1000 + ix) for ix in range(100 + 7 * sliceno)] for sliceno in range(params.slices)]
+	dw = DatasetWriter(name='source', columns=columns)
+	for sliceno in range(params.slices):
+		dw.set_slice(sliceno)
+		for r in want[sliceno]:
+			dw.write(*r)
+	source = dw.finish()
+	for colname in ('day', 'flag', 'frac', 'word',):
+		jid = subjobs.build('dataset_sort', options=dict(sort_columns=[colname]), datasets=dict(source=source))
+		ds = Dataset(jid)
+		for sliceno in range(params.slices):
+			got = list(ds.iterate(sliceno, order))
+			assert got == sorted(want[sliceno], key=sort_key(colname)), 'sorting on %s, slice %d' % (colname, sliceno,)
+	print('ok')
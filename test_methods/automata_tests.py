@@ -0,0 +1,35 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2017 eBay Inc.                                             #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+# Round trip tests for the column types, codecs and writer/import modes.
+# Add test_methods to method_directories and run
+#     automatarunner.py tests
+
+tests = (
+	'test_codecs',
+	'test_bloom',
+	'test_deferred',
+	'test_groups',
+	'test_csvimport',
+	'test_sort',
+	'test_rehash',
+)
+
+def main(urd):
+	for method in tests:
+		urd.build(method)